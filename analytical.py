@@ -1,22 +1,83 @@
+import functools
 import numpy as np
 import params as p
 
 
-def ground_truth(x_0, t):
+@functools.lru_cache(maxsize=None)
+def _control_coefficients(config):
+    """ Coefficients p1/x_0 and p2/x_0 of the analytical control, which only depend on the parameters of the problem. """
+    c = config
+    C1 = 1 + (c.LAMBDA_P*c.T**3)/(3*c.M_REAL**2)
+    C2 = (c.LAMBDA_P*c.T**2)/(2*c.M_REAL**2)
+    C3 = (c.LAMBDA_V*c.T**2)/(2*c.M_REAL**2)
+    C4 = 1 + (c.LAMBDA_V*c.T)/(c.M_REAL**2)
+    return (2*C4)/(C1*C4-C2*C3)*c.LAMBDA_P, -(2*C3)/(C1*C4-C2*C3)*c.LAMBDA_P
+
+
+def ground_truth(x_0, t, config=None):
     """ Analytical expressions of the trajectory, its derivative and the control for the continuous control problem. """
-    C1 = 1 + (p.LAMBDA_P*p.T**3)/(3*p.M_REAL**2)
-    C2 = (p.LAMBDA_P*p.T**2)/(2*p.M_REAL**2)
-    C3 = (p.LAMBDA_V*p.T**2)/(2*p.M_REAL**2)
-    C4 = 1 + (p.LAMBDA_V*p.T)/(p.M_REAL**2)
-    p1 = (2*C4)/(C1*C4-C2*C3)*p.LAMBDA_P*x_0
-    p2 = -(2*C3)/(C1*C4-C2*C3)*p.LAMBDA_P*x_0
-    x = p1/(12*p.M_REAL**2)*(p.T**3 - (p.T-t)**3) - p2/(4*p.M_REAL**2)*t**2 - (p.T**2*p1)/(4*p.M_REAL**2)*t + x_0
-    v = p1/(4*p.M_REAL**2)*(p.T-t)**2 - p2/(2*p.M_REAL**2)*t - (p.T**2*p1)/(4*p.M_REAL**2)
-    u = -1/(2*p.M_REAL)*(p1*(p.T-t) + p2)
+    c = p.get_config(config)
+    p1, p2 = (coefficient*x_0 for coefficient in _control_coefficients(c))
+    x = p1/(12*c.M_REAL**2)*(c.T**3 - (c.T-t)**3) - p2/(4*c.M_REAL**2)*t**2 - (c.T**2*p1)/(4*c.M_REAL**2)*t + x_0
+    v = p1/(4*c.M_REAL**2)*(c.T-t)**2 - p2/(2*c.M_REAL**2)*t - (c.T**2*p1)/(4*c.M_REAL**2)
+    u = -1/(2*c.M_REAL)*(p1*(c.T-t) + p2)
     return x, v, u
 
 
-def ground_truth_sample(x_0, res=10000):
+def ground_truth_sample(x_0, res=10000, config=None):
     """ Samples the analytical trajectory, its derivative and the analytical control for the continuous control problem. """
-    t = np.linspace(0, p.T, res)
-    return ground_truth(x_0, t)
+    c = p.get_config(config)
+    t = np.linspace(0, c.T, res)
+    return ground_truth(x_0, t, config=c)
+
+
+# Optimal costs
+
+def _quadratic_cost_coefficient(gramian, config):
+    """ Coefficient K of the optimal cost K*x_0**2 of the problem of minimizing the energy of the control plus the final cost,
+    when the final state (x_N, v_N) is (x_0, 0) plus a linear function of the control whose gramian (with respect to the energy) is given. """
+    final_cost_weights = np.diag([config.LAMBDA_P, config.LAMBDA_V])
+    return float(np.linalg.solve(np.eye(2) + final_cost_weights @ gramian, final_cost_weights)[0, 0])
+
+
+@functools.lru_cache(maxsize=None)
+def cost_coefficients(config):
+    """ Coefficients K of the optimal costs K*x_0**2 of the continuous problem and of the discretized problem, for the given config.
+    The discretized problem has N piece-wise constant controls applied to the exact dynamics (problem.dynamics), and the same costs as dynamic programming
+    (problem.running_cost and problem.final_cost), so that its optimum is the limit of the DP solution for fine grids.
+
+    :param ProblemConfig config: Parameters of the problem.
+    :return: The coefficients of the continuous and of the discretized problem.
+    :rtype: float, float.
+    """
+    c = config
+    continuous_gramian = np.array([[c.T**3/3, c.T**2/2], [c.T**2/2, c.T]])/c.M_REAL**2
+    # Effect of each control on the final position and velocity, scaled so that the energy of the controls is their squared norm
+    effects = np.stack([c.DT**2/c.M_REAL*(c.N - np.arange(c.N) - 0.5), np.full(c.N, c.DT/c.M_REAL)])/np.sqrt(c.DT)
+    return _quadratic_cost_coefficient(continuous_gramian, c), _quadratic_cost_coefficient(effects @ effects.T, c)
+
+
+def optimal_cost(x_0, discretized=False, config=None):
+    """ Optimal cost of the continuous problem (the cost of the analytical solution), or of the discretized problem (see cost_coefficients),
+    computed in closed form for an initial position or an array of initial positions. """
+    continuous_coefficient, discretized_coefficient = cost_coefficients(p.get_config(config))
+    return (discretized_coefficient if discretized else continuous_coefficient)*np.square(x_0)
+
+
+def regret_table(costs, x_0, config=None):
+    """ Regrets of the costs achieved from initial positions x_0 (arrays of the same dimension), with respect to the optimal costs.
+
+    :return dict: Arrays of the initial positions, achieved costs, optimal costs of the continuous and discretized problems and regrets with respect to both,
+    named "x_0", "cost", "optimal_cost", "discretized_optimal_cost", "regret" and "discretized_regret".
+    """
+    c = p.get_config(config)
+    costs, x_0 = np.asarray(costs, dtype=float), np.asarray(x_0, dtype=float)
+    optimal_costs, discretized_optimal_costs = optimal_cost(x_0, config=c), optimal_cost(x_0, discretized=True, config=c)
+    return {
+        "x_0": x_0,
+        "cost": costs,
+        "optimal_cost": optimal_costs,
+        "discretized_optimal_cost": discretized_optimal_costs,
+        "regret": costs - optimal_costs,
+        "discretized_regret": costs - discretized_optimal_costs
+    }
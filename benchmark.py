@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import itertools
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+import params as p
+from problem import J, simulator, batch_simulator
+from open_loop import OpenLoopEvaluator, solve_open_loop, solve_by_bfgs
+from dp_solver import solve_dp, policy_from_array
+from dp_multires import solve_coarse_to_fine
+from dp_rl import make_cart_env
+from cart_env import CartEnv
+from policy_export import distill_dp
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baseline.json")  # Reference results committed with the code
+MACHINE_METADATA = ("python", "numpy", "platform", "processor", "cpu_count", "N", "N_U")  # Metadata that must match for timings to be comparable
+
+
+# Measurements
+
+def measure(function, repeats=20, warmup=1, items=1, min_sample_time=0.05):
+    """ Measures the wall time of calls to function (after warmup calls), and the peak memory allocated during one more call (traced separately, so as not to slow down the timed calls).
+    As with timeit, each of the repeats samples times a batch of calls, whose number is chosen so that a sample lasts at least min_sample_time,
+    so that fast functions are not dominated by the resolution and the noise of the clock.
+
+    :param function function: The function to measure, called without argument.
+    :param (int, optional) repeats: Number of timed samples. Defaults to 20.
+    :param (int, optional) warmup: Number of calls made before timing, e.g. to fill caches. Defaults to 1.
+    :param (int, optional) items: Number of items (e.g. steps or trajectories) processed by a call, to compute a throughput. Defaults to 1.
+    :param (float, optional) min_sample_time: Minimal duration of a sample, in seconds. Defaults to 0.05.
+    :return dict: Median, 10th and 90th percentiles, min and max of the wall time of a call in seconds, the number of calls per sample,
+    throughput in items per second (based on the median), and peak memory in bytes as measured by tracemalloc (which does not trace the memory allocated by torch).
+    """
+    for _ in range(warmup):
+        function()
+    # Number of calls per sample, increased as 1, 2, 5, 10, 20... until a sample lasts long enough (the calibration samples also warm up)
+    number = 1
+    for multiple in itertools.cycle((2, 2.5, 2)):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - start >= min_sample_time:
+            break
+        number = round(number*multiple)
+    times = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times[i] = (time.perf_counter() - start)/number
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    median = float(np.median(times))
+    return {
+        "median": median,
+        "p10": float(np.percentile(times, 10)),
+        "p90": float(np.percentile(times, 90)),
+        "min": float(np.min(times)),
+        "max": float(np.max(times)),
+        "repeats": repeats,
+        "number": number,
+        "items_per_second": items/median,
+        "peak_memory": peak_memory
+    }
+
+
+# Benchmarks, each yielding its cases as (name, function, measure options) for the current config
+
+def _problem_benchmarks():
+    x_0s = np.linspace(-1, 0, 1000)
+    u = solve_open_loop(x_0s, p.M_REAL)
+    open_loop_policy = lambda t, x, v: u[0, round(t/p.DT)]
+    batch_open_loop_policy = lambda t, x, v: u[:, round(t[0]/p.DT)]
+    evaluator = OpenLoopEvaluator(p.M_REAL)
+    yield "simulator", lambda: simulator(x_0s[0], open_loop_policy), {}
+    yield "batch_simulator_1000", lambda: batch_simulator(x_0s, batch_open_loop_policy), {"items": 1000}
+    yield "J", lambda: J(u[0], x_0s[0], p.M_REAL), {}
+    yield "J_1000", lambda: J(u, x_0s, p.M_REAL), {"items": 1000}
+    yield "gradient", lambda: evaluator.gradient(u[0], x_0s[0]), {}
+    yield "bfgs", lambda: solve_by_bfgs(x_0s[0], p.M_REAL), {}
+    yield "solve_open_loop_1000", lambda: solve_open_loop(x_0s, p.M_REAL), {"items": 1000}
+
+
+def _dp_benchmarks(dp_configs=((2, 4), (4, 4), (8, 1), (8, 4)), coarse_to_fine_resolutions=(17, 33)):
+    for N, N_U in dp_configs:
+        config = p.get_config().replace(N=N, N_U=N_U)
+        yield f"dp_N{N}_NU{N_U}", lambda config=config: solve_dp(storage="banded", keep_value_function=False, config=config), {"repeats": 3, "warmup": 0}
+    for resolution in coarse_to_fine_resolutions:
+        yield f"coarse_to_fine_dp_R{resolution}", lambda resolution=resolution: solve_coarse_to_fine(resolution=resolution), {"repeats": 3, "warmup": 0}
+
+
+def _env_benchmarks(n_envs_values=(1, 8, 64), n_steps=200):
+    env = CartEnv()
+    env.reset()
+    action = np.zeros(1, dtype=np.float32)
+    def run_single_env():
+        for _ in range(n_steps):
+            _, _, _, truncated, _ = env.step(action)
+            if truncated:
+                env.reset()
+    yield "cart_env_step", run_single_env, {"repeats": 5, "items": n_steps}
+    for native_vec_env in (False, True):
+        for n_envs in n_envs_values:
+            env = make_cart_env(n_envs, native_vec_env=native_vec_env)
+            env.reset()
+            actions = np.zeros((n_envs, 1), dtype=np.float32)
+            def run(env=env, actions=actions):
+                for _ in range(n_steps):
+                    env.step(actions)
+            yield f"{'native_' if native_vec_env else ''}env_step_{n_envs}", run, {"repeats": 5, "items": n_steps*n_envs}
+
+
+def _inference_benchmarks(dp_config=(8, 4)):
+    from stable_baselines3 import PPO
+    model = PPO("MultiInputPolicy", make_cart_env(1, native_vec_env=True), device="cpu")  # The weights do not matter for latency
+    observation = dict(cart_state=np.array([-0.5, 0.], dtype=np.float32), timestep=0)
+    yield "ppo_predict", lambda: model.predict(observation, deterministic=True), {}
+    config = p.get_config().replace(N=dp_config[0], N_U=dp_config[1])
+    _, optimal_policy_array = solve_dp(storage="banded", keep_value_function=False, config=config)
+    dp_policy = policy_from_array(optimal_policy_array, config=config)
+    tabular_policy = distill_dp(optimal_policy_array, x_size=201, v_size=201, config=config)
+    states = (np.zeros(1000), -np.random.default_rng(0).random(1000), np.zeros(1000))
+    yield "dp_policy", lambda: dp_policy(0., -0.5, 0.), {}
+    yield "dp_policy_1000", lambda: dp_policy(*states), {"items": 1000}
+    yield "tabular_policy", lambda: tabular_policy(0., -0.5, 0.), {}
+    yield "tabular_policy_1000", lambda: tabular_policy(*states), {"items": 1000}
+
+
+BENCHMARKS = {"problem": _problem_benchmarks, "dp": _dp_benchmarks, "env": _env_benchmarks, "inference": _inference_benchmarks}
+
+
+def run_benchmarks(groups=None, repeats_scale=1.):
+    """ Runs the benchmarks of the given groups (all the groups of BENCHMARKS if None) for the current config.
+
+    :param (iterable[string], optional) groups: Names of the benchmark groups to run. Defaults to None.
+    :param (float, optional) repeats_scale: Factor applied to the number of repeats of every case, e.g. 0.1 for a quick run. Defaults to 1.
+    :return dict: The results by case name (see measure), with metadata on the machine and the config.
+    """
+    results = {}
+    for group in groups or BENCHMARKS:
+        for name, function, options in BENCHMARKS[group]():
+            options = dict(options, repeats=max(1, round(options.get("repeats", 20)*repeats_scale)))
+            results[name] = measure(function, **options)
+            print(f"{name}: median {results[name]['median']*1e3:.3f}ms, p90 {results[name]['p90']*1e3:.3f}ms ({results[name]['number']} calls per sample), peak memory {results[name]['peak_memory']/2**20:.1f}MB")
+    metadata = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "N": p.N,
+        "N_U": p.N_U
+    }
+    return {"metadata": metadata, "results": results}
+
+
+def compare(results, baseline, tolerance=0.2, memory_slack=2**20):
+    """ Compares benchmark results with a baseline (both as returned by run_benchmarks).
+    To be robust to the noise of the machine, a case is only slower than its baseline when both its median wall time exceeds the 90th percentile of the baseline,
+    and its min wall time exceeds the min of the baseline, by more than the tolerance.
+
+    :param (float, optional) tolerance: Relative increase of the wall time (or of the peak memory) beyond which a case is reported as a regression. Defaults to 0.2.
+    :param (int, optional) memory_slack: Increase of the peak memory, in bytes, below which no regression is reported, since small allocations vary between runs. Defaults to 1MB.
+    :return list[string]: Descriptions of the regressions, for the cases present in both results.
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        reference = baseline["results"][name]
+        if result["median"] > (1 + tolerance)*reference["p90"] and result["min"] > (1 + tolerance)*reference["min"]:
+            regressions.append(f"{name}: median {result['median']:.6g} vs p90 {reference['p90']:.6g} in baseline (+{result['median']/reference['median'] - 1:.0%} on the median)")
+        if reference["peak_memory"] > 0 and result["peak_memory"] > (1 + tolerance)*reference["peak_memory"] + memory_slack:
+            regressions.append(f"{name}: peak_memory {result['peak_memory']:.6g} vs {reference['peak_memory']:.6g} in baseline (+{result['peak_memory']/reference['peak_memory'] - 1:.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the solvers, the environments and policy inference of the cart problem.")
+    parser.add_argument("--groups", nargs="+", choices=list(BENCHMARKS), default=None, help="Benchmark groups to run. Defaults to all.")
+    parser.add_argument("--output", default="benchmark.json", help="Path to the JSON file where results are written.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Path to the JSON results of a previous run to compare with, if it exists. The exit code is 1 if regressions are found. Defaults to benchmarks/baseline.json.")
+    parser.add_argument("--no-baseline", action="store_true", help="Skips the comparison with a baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown beyond which a case is a regression.")
+    parser.add_argument("--repeats-scale", type=float, default=1., help="Factor applied to the number of repeats of every case.")
+    args = parser.parse_args()
+    # The baseline is read before running, so that it can be updated by writing the results to its path
+    baseline = None
+    if not args.no_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+    elif not args.no_baseline:
+        print(f"No baseline found at {args.baseline}, results are not compared.")
+    results = run_benchmarks(args.groups, repeats_scale=args.repeats_scale)
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=4)
+    if baseline is not None:
+        differences = [f"{name} {baseline['metadata'].get(name)} vs {results['metadata'][name]}" for name in MACHINE_METADATA if baseline["metadata"].get(name) != results["metadata"][name]]
+        if differences:
+            print("WARNING: The baseline was recorded on a different setup, so timings may not be comparable:", ", ".join(differences))
+        regressions = compare(results, baseline, tolerance=args.tolerance)
+        print("Regressions:" if regressions else "No regression.", *regressions, sep="\n")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,125 @@
+import numpy as np
+import gymnasium as gym
+import params as p
+from problem import cost, dynamics, running_cost, final_cost
+
+
+def cart_spaces(config=None):
+    """ Returns the observation space (time step, position and velocity) and the action space (action exerted on the cart) of the accelerated cart problem,
+    for the given config (or the current one if None). """
+    c = p.get_config(config)
+    observation_space = gym.spaces.Dict(
+        {
+            "cart_state": gym.spaces.Box(-np.inf, np.inf, shape=(2,), dtype=np.float32),
+            "timestep": gym.spaces.Discrete(c.N+1),
+        }
+    )
+    action_space = gym.spaces.Box(c.U_L, c.U_R, shape=(1,), dtype=np.float32)
+    return observation_space, action_space
+
+
+class CartEnv(gym.Env):
+    """ Environment for the accelarated cart problem. See gymnasium documentation for further details. """
+    metadata = {"render_modes": ["human"]}
+
+    def __init__(self, render_mode=None, record_history=False, config=None):
+        # The parameters of the problem are fixed at creation, so that environments for different configs can coexist.
+        self.config = p.get_config(config)
+        # Observation space is time, position and velocity; action space is Boxes of shape (1,), containing the action exerted on the cart.
+        self.observation_space, self.action_space = cart_spaces(self.config)
+        self.timestep = 0  # Current timestep
+        self.x_0 = None  # Initial position of the cart
+        self.x, self.x_dot = None, None  # Current position and velocity of the cart
+        assert render_mode is None or render_mode in self.metadata["render_modes"]
+        self.render_mode = render_mode
+        # Histories are only recorded for rendering (or if requested), in buffers preallocated for a whole episode.
+        self.record_history = record_history or render_mode == "human"
+        self._x_history = np.zeros(self.config.N+1) if self.record_history else None
+        self._v_history = np.zeros(self.config.N+1) if self.record_history else None
+        self._u_history = np.zeros(self.config.N) if self.record_history else None
+        self._cart_state = np.zeros(2, dtype=np.float32)  # Observation buffer, reused at every step of an episode
+
+    @property
+    def x_history(self):
+        """ History of the position over the current episode, or None if histories are not recorded. """
+        return self._x_history[:self.timestep+1] if self.record_history else None
+
+    @property
+    def v_history(self):
+        """ History of the velocity over the current episode, or None if histories are not recorded. """
+        return self._v_history[:self.timestep+1] if self.record_history else None
+
+    @property
+    def u_history(self):
+        """ History of the control over the current episode, or None if histories are not recorded. """
+        return self._u_history[:self.timestep] if self.record_history else None
+
+    def _get_obs(self):
+        """ Return the current position and velocity of the cartn as well as the current time step of the evolution.
+        The cart state is written in a buffer that is reused at every step of an episode, so it must be copied to be kept. """
+        self._cart_state[0], self._cart_state[1] = self.x, self.x_dot
+        return dict(cart_state=self._cart_state, timestep=self.timestep)
+
+    def _get_info(self):
+        return {}
+
+    def reset(self, seed=None, options=None, x_0=None):
+        """ Reset the environment, picking a new initial position x_0 randomly in [-1, 0] (unless x_0 is specified) and reinitializing the time step and histories of the position, velocity and control (if recorded).
+        Returns the initial position, velocity and time step. """
+        super().reset(seed=seed)
+        self.x_0 = -self.np_random.random() if x_0 is None else x_0
+        self.timestep = 0
+        self.x, self.x_dot = self.x_0, 0
+
+        # A new observation buffer is used for each episode, so that the last observation of the previous episode remains valid (e.g. as terminal observation).
+        self._cart_state = np.zeros(2, dtype=np.float32)
+        observation = self._get_obs()
+        info = self._get_info()
+
+        if self.record_history:
+            self._x_history[0] = self.x
+            self._v_history[0] = self.x_dot
+
+        return observation, info
+
+    def step(self, action):
+        """ Given an action, simulates one step of the evolution and returns the new position, velocity and time step as well as the reward and an indication whether the evolution has terminated.
+        Also updates the history of the position, velocity and control, if recorded. """
+        u = action[0]
+        self.timestep += 1
+        self.x, self.x_dot = dynamics(self.x, self.x_dot, u, config=self.config)
+        truncated = self.timestep == self.config.N
+
+        # Let's use the rewards already defined for dynamic programming
+        reward = -final_cost(self.x, self.x_dot, config=self.config) if truncated else -running_cost(self.x, self.x_dot, u, config=self.config)
+        observation = self._get_obs()
+        info = self._get_info()
+
+        if self.record_history:
+            self._x_history[self.timestep] = self.x
+            self._v_history[self.timestep] = self.x_dot
+            self._u_history[self.timestep-1] = u
+
+        return observation, reward, False, truncated, info
+
+    def render(self):
+        """ Renders the evolution, plotting the trajectory in terms of position and velocity and the control over the evolution, with the analytical solution for comparison.
+        Also prints the total cost, together with the cost of the analytical solution. """
+        if self.render_mode == "human":
+            # Plotting and analytical helpers are only needed for rendering, so they are not imported with the environment.
+            from utils import plot_trajectory, plot_control
+            from analytical import ground_truth_sample, optimal_cost
+            gt_x, gt_v, gt_u = ground_truth_sample(self.x_0, config=self.config)
+            print("Trajectory (position and velocity) and cotnrol for the terminating run:")
+            plot_trajectory(predicted_x=self.x_history, gt_x=gt_x)
+            plot_trajectory(predicted_x=self.v_history, gt_x=gt_v, title="velocity")
+            plot_control(predicted_u=self.u_history, gt_u=gt_u)
+            print("Approximate cost achieved by the agent:", cost(x=self.x_history, x_dot=self.v_history, u=self.u_history, config=self.config))
+            print("Analytical cost:", optimal_cost(self.x_0, config=self.config))
+
+    def close(self):
+        pass
+
+
+# Register the environment on import, with an entry point that subprocesses (e.g. SubprocVecEnv workers) can import by themselves.
+gym.register("AcceleratedCart-v1", entry_point="cart_env:CartEnv")
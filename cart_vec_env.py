@@ -0,0 +1,119 @@
+import numpy as np
+import gymnasium as gym
+import params as p
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+from problem import dynamics, running_cost, final_cost
+from cart_env import cart_spaces
+
+
+class CartVecEnv(VecEnv):
+    """ Vectorized environment for the accelerated cart problem, simulating n_envs carts at once.
+    Instead of stepping n_envs separate CartEnv objects, the positions, velocities, time steps and initial positions of all carts are held in arrays,
+    so that stepping and automatically resetting every environment is done in a single NumPy call.
+    Like the environments built by make_vec_env("AcceleratedCart-v1", n_envs), it returns stacked Dict observations compatible with "MultiInputPolicy",
+    and the last observation of an episode is stored in the "terminal_observation" info of the corresponding environment. See stable-baselines3 documentation for further details.
+    """
+
+    def __init__(self, n_envs=1, seed=None, config=None):
+        """
+        :param (int, optional) n_envs: Number of simulated carts. Defaults to 1.
+        :param (int, optional) seed: Seed of the random generator used to draw the initial positions. Defaults to None.
+        :param (ProblemConfig, optional) config: Parameters of the problem. If None, uses the current config. Defaults to None.
+        """
+        self.config = p.get_config(config)
+        observation_space, action_space = cart_spaces(self.config)
+        super().__init__(n_envs, observation_space, action_space)
+        self.x_0 = np.zeros(n_envs)  # Initial positions of the carts
+        self.x, self.x_dot = np.zeros(n_envs), np.zeros(n_envs)  # Current positions and velocities of the carts
+        self.timestep = np.zeros(n_envs, dtype=np.int64)  # Current time steps
+        self.actions = None
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """ Seeds the random generator used to draw the initial positions, which is shared by all the environments. """
+        self.np_random, seed = gym.utils.seeding.np_random(seed)
+        return [seed]*self.num_envs
+
+    def _reset_envs(self, mask, x_0=None):
+        """ Resets the environments selected by mask (a boolean mask or an array of indices), picking new initial positions randomly in [-1, 0] (unless x_0 is specified). """
+        self.x_0[mask] = -self.np_random.random(self.x_0[mask].shape[0]) if x_0 is None else x_0
+        self.timestep[mask] = 0
+        self.x[mask], self.x_dot[mask] = self.x_0[mask], 0
+
+    def _get_obs(self, mask=slice(None)):
+        """ Returns the current positions and velocities of the carts as well as the current time steps, for the environments selected by mask. """
+        return dict(cart_state=np.stack([self.x[mask], self.x_dot[mask]], axis=-1).astype(np.float32), timestep=self.timestep[mask].copy())
+
+    def reset(self, x_0=None):
+        """ Resets all the environments, picking new initial positions randomly in [-1, 0] unless x_0 (a float or an array of n_envs floats) is specified.
+        Returns the initial observations. """
+        self._reset_envs(np.ones(self.num_envs, dtype=bool), x_0=x_0)
+        self.reset_infos = [{} for _ in range(self.num_envs)]
+        return self._get_obs()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        """ Simulates one step of the evolution for all the environments, returning the new observations, the rewards, whether the episodes are done and infos.
+        Environments whose episode is done are reset. """
+        u = np.asarray(self.actions, dtype=np.float64).reshape(self.num_envs, -1)[:, 0]
+        self.timestep += 1
+        self.x, self.x_dot = dynamics(self.x, self.x_dot, u, config=self.config)
+        dones = self.timestep >= self.config.N
+
+        # Let's use the rewards already defined for dynamic programming
+        rewards = np.where(dones, -final_cost(self.x, self.x_dot, config=self.config), -running_cost(self.x, self.x_dot, u, config=self.config)).astype(np.float32)
+        infos = [{"TimeLimit.truncated": done} for done in dones.tolist()]
+        if np.any(dones):
+            terminal_observations = self._get_obs(dones)
+            for i, env_idx in enumerate(np.flatnonzero(dones)):
+                infos[env_idx]["terminal_observation"] = {key: value[i] for key, value in terminal_observations.items()}
+            self._reset_envs(dones)
+        return self._get_obs(), rewards, dones, infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        """ Returns an attribute for each of the selected environments. Per-environment arrays (x, x_dot, timestep, x_0) are indexed. """
+        value = getattr(self, attr_name)
+        if isinstance(value, np.ndarray) and value.shape[:1] == (self.num_envs,):
+            return [value[i] for i in self._get_indices(indices)]
+        return [value for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        """ Sets an attribute for the selected environments. Per-environment arrays (x, x_dot, timestep, x_0) are only modified at the selected indices. """
+        attribute = getattr(self, attr_name, None)
+        if isinstance(attribute, np.ndarray) and attribute.shape[:1] == (self.num_envs,):
+            attribute[list(self._get_indices(indices))] = value
+        else:
+            setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """ Calls a method of each of the selected environments, as if they were separate CartEnv objects, returning the results in a list.
+        Since the carts are held in arrays, the supported methods are reset (with optional seed and x_0, a float or an array of floats for the selected environments),
+        render (which does nothing, CartVecEnv having no render mode), and get_wrapper_attr and set_wrapper_attr (see get_attr and set_attr).
+        Other methods raise an AttributeError. """
+        indices = np.asarray(list(self._get_indices(indices)), dtype=np.intp)
+        if method_name == "reset":
+            if method_kwargs.get("seed") is not None:
+                self.seed(method_kwargs["seed"])
+            self._reset_envs(indices, x_0=method_kwargs.get("x_0"))
+            observations = self._get_obs(indices)
+            return [({key: value[i] for key, value in observations.items()}, {}) for i in range(indices.shape[0])]
+        if method_name == "render":
+            return [None for _ in indices]
+        if method_name == "get_wrapper_attr":
+            return self.get_attr(*method_args, indices=indices.tolist(), **method_kwargs)
+        if method_name == "set_wrapper_attr":
+            self.set_attr(*method_args, indices=indices.tolist(), **method_kwargs)
+            return [None for _ in indices]
+        raise AttributeError(f"CartVecEnv does not hold separate environments, and does not support calling their method {method_name}.")
+
+    def get_images(self):
+        """ Returns no image for each environment, since CartVecEnv has no render mode. """
+        return [None for _ in range(self.num_envs)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,118 @@
+import os
+import json
+import shutil
+import hashlib
+import dataclasses
+import numpy as np
+import params as p
+from problem import problem_parameters
+from dp_solver import solve_dp
+from dp_storage import BandedArray
+
+
+DEFAULT_CACHE_DIR = ".dp_cache"  # Folder containing the solved DP tables
+DEFAULT_MAX_BYTES = 8*2**30  # Size budget of the cache, beyond which least recently used entries are evicted
+
+
+# Cache entries
+
+_FLOAT_PARAMETERS = {field.name for field in dataclasses.fields(p.ProblemConfig) if field.type is float}
+
+
+def cache_key(config=None, **solver_options):
+    """ Returns the key identifying a DP solution, obtained by hashing the problem parameters of config (the current ones if None, as saved for trained models)
+    together with the options of the solver that change the stored tables.
+    Float parameters are hashed as floats, so that equal configs (e.g. with M_REAL=1 and M_REAL=1.0) have the same key. """
+    parameters = {name: float(value) if name in _FLOAT_PARAMETERS else value for name, value in problem_parameters(config).items()}
+    parameters.update(solver_options)
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def _save_table(entry_path, name, table):
+    """ Saves a dense or banded DP table in a cache entry. """
+    if isinstance(table, BandedArray):
+        table.save(entry_path, name)
+    else:
+        np.save(os.path.join(entry_path, f"{name}.npy"), table)
+
+
+def _load_table(entry_path, name):
+    """ Reopens a DP table saved in a cache entry, memory-mapping its data in read-only mode. """
+    if os.path.exists(os.path.join(entry_path, f"{name}_layout.json")):
+        return BandedArray.load(entry_path, name, mmap_mode="r")
+    return np.load(os.path.join(entry_path, f"{name}.npy"), mmap_mode="r")
+
+
+def _entry_size(entry_path):
+    """ Number of bytes used on disk by a cache entry. """
+    return sum(os.path.getsize(os.path.join(entry_path, file)) for file in os.listdir(entry_path))
+
+
+def _touch(entry_path):
+    """ Marks a cache entry as used now. The modification time of the entry folder serves as last access time for LRU eviction. """
+    os.utime(entry_path)
+
+
+def evict(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, keep=()):
+    """ Removes the least recently used entries of the cache until its size fits in max_bytes.
+
+    :param (string, optional) cache_dir: Path to the cache folder. Defaults to DEFAULT_CACHE_DIR.
+    :param (int, optional) max_bytes: Size budget of the cache in bytes. Defaults to DEFAULT_MAX_BYTES.
+    :param (iterable[string], optional) keep: Keys of entries that must not be evicted, even if the budget is exceeded. Defaults to ().
+    :return list[string]: The keys of the evicted entries.
+    """
+    entries = [entry for entry in os.listdir(cache_dir) if os.path.exists(os.path.join(cache_dir, entry, "parameters.json"))]
+    entries.sort(key=lambda entry: os.path.getmtime(os.path.join(cache_dir, entry)))
+    sizes = {entry: _entry_size(os.path.join(cache_dir, entry)) for entry in entries}
+    total_size = sum(sizes.values())
+    evicted = []
+    for entry in entries:
+        if total_size <= max_bytes:
+            break
+        if entry in keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+        total_size -= sizes[entry]
+        evicted.append(entry)
+    return evicted
+
+
+# Cached solver
+
+def cached_solve_dp(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, storage="dense", keep_value_function=True, max_batch_size=2**22, config=None):
+    """ Solves the discretized control problem by dynamic programming (see dp_solver.solve_dp), reusing the solution stored on disk if the same problem was already solved.
+    On a cache hit, V and the optimal policy array are reopened with np.memmap, so that only the pages that are actually read are loaded from disk.
+    On a cache miss, the problem is solved, the tables are written as .npy files and least recently used entries are evicted if the cache exceeds max_bytes.
+
+    :param (string, optional) cache_dir: Path to the cache folder. Defaults to DEFAULT_CACHE_DIR.
+    :param (int, optional) max_bytes: Size budget of the cache in bytes. Defaults to DEFAULT_MAX_BYTES.
+    :param (string, optional) storage: Storage of the tables, see dp_solver.solve_dp. Defaults to "dense".
+    :param (bool, optional) keep_value_function: See dp_solver.solve_dp. Defaults to True.
+    :param (int, optional) max_batch_size: See dp_solver.solve_dp. Defaults to 2**22.
+    :param (ProblemConfig, optional) config: Parameters of the problem to solve. If None, uses the current config. Defaults to None.
+    :return: The value function V and the optimal policy array, as read-only memory-mapped arrays on a cache hit.
+    :rtype: np.ndarray[float] or BandedArray, np.ndarray[float] or BandedArray
+    """
+    solver_options = {"storage": storage, "keep_value_function": keep_value_function or storage == "dense"}
+    key = cache_key(config, **solver_options)
+    entry_path = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(entry_path, "parameters.json")):
+        _touch(entry_path)
+        return _load_table(entry_path, "V"), _load_table(entry_path, "optimal_policy")
+
+    V, optimal_policy_array = solve_dp(max_batch_size=max_batch_size, storage=storage, keep_value_function=keep_value_function, config=config)
+
+    # Write the entry in a temporary folder first, so that an interrupted write never leaves an incomplete entry behind.
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_entry_path = f"{entry_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_entry_path, exist_ok=True)
+    _save_table(tmp_entry_path, "V", V)
+    _save_table(tmp_entry_path, "optimal_policy", optimal_policy_array)
+    with open(os.path.join(tmp_entry_path, "parameters.json"), "w") as parameters_file:
+        json.dump(dict(problem_parameters(config), **solver_options), parameters_file, indent=4)
+    try:
+        os.rename(tmp_entry_path, entry_path)
+    except OSError:  # The same problem was cached concurrently
+        shutil.rmtree(tmp_entry_path, ignore_errors=True)
+    evict(cache_dir, max_bytes, keep=(key,))
+    return V, optimal_policy_array
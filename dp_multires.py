@@ -0,0 +1,204 @@
+import time
+import argparse
+import numpy as np
+import params as p
+from problem import dynamics, running_cost, final_cost, batch_simulator
+from evaluation import evaluate_batch
+from grid import bilinear_interpolation
+# Unlike dp_solver, the grids of this module do not depend on DX and DV, so that the time step can be refined without the state grid exploding.
+
+
+# Value functions on per-time-step grids
+
+def reachable_box(n, config=None):
+    """ Returns the bounds ((x_low, x_high), (v_low, v_high)) of the states reachable at time step n from x_0 in [-1, 0] and a null velocity.
+    The dynamics map the box of time step n into the box of time step n+1. """
+    c = p.get_config(config)
+    t = n*c.DT
+    return (-1 + c.U_L*t**2/(2*c.M_REAL), c.U_R*t**2/(2*c.M_REAL)), (c.U_L*t/c.M_REAL, c.U_R*t/c.M_REAL)
+
+
+class GridValueFunction:
+    """ Value function stored at each time step on a regular grid of the same shape, over a box that may change with the time step
+    (e.g. the band of states around the optimal trajectories), and interpolated bilinearly between grid points.
+    Boxes can be flat along an axis (e.g. the velocities at time step 0), in which case the grid points along this axis coincide.
+    """
+
+    def __init__(self, lows, highs, shape):
+        """
+        :param np.ndarray[float] lows: Lower bounds (x_low, v_low) of the boxes, of dimension (N+1) x 2.
+        :param np.ndarray[float] highs: Upper bounds (x_high, v_high) of the boxes, of dimension (N+1) x 2.
+        :param tuple shape: Number of positions and velocities of the grids.
+        """
+        self.lows, self.highs = np.asarray(lows, dtype=float), np.asarray(highs, dtype=float)
+        self.shape = tuple(shape)
+        self.spacings = (self.highs - self.lows)/(np.array(self.shape) - 1)
+        self.values = np.full((self.lows.shape[0], *self.shape), np.inf)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def points(self, n):
+        """ Returns the positions and velocities of the grid of time step n. """
+        return tuple(np.linspace(self.lows[n, axis], self.highs[n, axis], self.shape[axis]) for axis in (0, 1))
+
+    def contains(self, n, x, v, tolerance=1e-9):
+        """ Returns whether the states (n, x, v), given as scalars or arrays broadcast together, lie in the boxes of their time steps. """
+        lows, highs = self.lows[n] - tolerance, self.highs[n] + tolerance
+        return (x >= lows[..., 0]) & (x <= highs[..., 0]) & (v >= lows[..., 1]) & (v <= highs[..., 1])
+
+    def interpolate(self, n, x, v):
+        """ Interpolates the value function bilinearly at the states (n, x, v), given as scalars or arrays broadcast together.
+        States out of the box of their time step are clipped to the box. """
+        n, x, v = np.broadcast_arrays(np.asarray(n), x, v)
+        # Flat boxes have a null spacing, in which case all the states are at fractional index 0
+        fx, fv = (np.divide(values - self.lows[n, axis], self.spacings[n, axis], out=np.zeros(n.shape), where=self.spacings[n, axis] > 0) for axis, values in ((0, x), (1, v)))
+        return bilinear_interpolation(self.values, n, fx, fv)[()]
+
+
+class MultiResolutionValueFunction:
+    """ Stack of GridValueFunction levels, from a coarse one covering all the reachable states to finer ones covering narrower bands.
+    A state is valued by the finest level whose box contains it. """
+
+    def __init__(self, levels=None):
+        self.levels = list(levels or [])
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    def __call__(self, n, x, v):
+        """ Value of the states (n, x, v), given as scalars or arrays broadcast together. """
+        n, x, v = np.broadcast_arrays(np.asarray(n), x, v)
+        values = self.levels[0].interpolate(n, x, v)
+        for level in self.levels[1:]:
+            inside = level.contains(n, x, v)
+            if np.any(inside):
+                values = np.where(inside, level.interpolate(n, x, v), values)
+        return values[()]
+
+
+# Semi-Lagrangian dynamic programming
+
+def _action_space(config):
+    return np.arange(config.U_L, config.U_R+config.DU, config.DU)
+
+
+def _backward_pass(level, value_function, config, max_batch_size):
+    """ Computes the values of a new level by dynamic programming, the values of the next time step being read from value_function,
+    which must include the new level (whose values of time step n+1 are computed before those of time step n). """
+    c = config
+    action_space = _action_space(c)
+    xs, vs = level.points(c.N)
+    level.values[c.N] = final_cost(xs[:, None], vs[None, :], config=c)
+    chunk_size = max(1, max_batch_size // (level.shape[1]*action_space.shape[0]))
+    for n in range(c.N-1, -1, -1):
+        xs, vs = level.points(n)
+        v, a = vs[None, :, None], action_space[None, None, :]
+        for start in range(0, xs.shape[0], chunk_size):
+            x = xs[start:start+chunk_size, None, None]
+            x_new, v_new = dynamics(x, v, a, config=c)
+            total_costs = running_cost(x, v, a, config=c) + value_function(n+1, x_new, v_new)
+            level.values[n, start:start+chunk_size] = np.min(total_costs, axis=-1)
+
+
+def greedy_policy(value_function, config=None):
+    """ Returns the policy choosing the action that minimizes the running cost plus the interpolated value of the next state,
+    usable by problem.simulator and problem.batch_simulator (it accepts arrays of times, positions and velocities). """
+    c = p.get_config(config)
+    action_space = _action_space(c)
+    def policy(t, x, v):
+        n, x, v = np.broadcast_arrays(np.rint(np.asarray(t)/c.DT).astype(np.intp), x, v)
+        x_new, v_new = dynamics(x[..., None], v[..., None], action_space, config=c)
+        total_costs = running_cost(x[..., None], v[..., None], action_space, config=c) + value_function(n[..., None] + 1, x_new, v_new)
+        return action_space[np.argmin(total_costs, axis=-1)][()]
+    return policy
+
+
+def solve_coarse_to_fine(resolution=33, levels=3, margin=2., n_trajectories=21, max_batch_size=2**22, config=None):
+    """ Solves the discretized control problem by semi-Lagrangian dynamic programming on grids whose size does not depend on DX and DV:
+    the value function is computed on a resolution x resolution grid at each time step, and interpolated bilinearly between grid points.
+    The first level covers all the reachable states. Each further level covers the band of states visited by the optimal trajectories of the previous levels
+    (simulated from n_trajectories initial positions evenly spread in [-1, 0]), widened by margin grid steps of the previous level, with the same number of grid points,
+    so that its grid is finer. States leaving the band of a level are valued by the previous levels.
+    Memory is levels*(N+1)*resolution**2 values, and the accuracy is tuned by resolution and levels.
+
+    :param (int, optional) resolution: Number of positions and velocities of the grids. Defaults to 33.
+    :param (int, optional) levels: Number of levels of the value function. Defaults to 3.
+    :param (float, optional) margin: Number of grid steps of the previous level by which the bands of the optimal trajectories are widened. Defaults to 2.
+    :param (int, optional) n_trajectories: Number of optimal trajectories defining the bands. Defaults to 21.
+    :param (int, optional) max_batch_size: Maximal number of (x, v, a) triplets evaluated in a single batch. Defaults to 2**22.
+    :param (ProblemConfig, optional) config: Parameters of the problem to solve. If None, uses the current config. Defaults to None.
+    :return: The value function and the greedy policy it defines (see greedy_policy).
+    :rtype: MultiResolutionValueFunction, function.
+    """
+    c = p.get_config(config)
+    boxes = np.array([reachable_box(n, config=c) for n in range(c.N+1)])  # (N+1) x 2 (x and v) x 2 (low and high)
+    value_function = MultiResolutionValueFunction()
+    level = GridValueFunction(boxes[..., 0], boxes[..., 1], (resolution, resolution))
+    for _ in range(levels):
+        value_function.levels.append(level)
+        _backward_pass(level, value_function, c, max_batch_size)
+        x, v, _ = batch_simulator(np.linspace(-1, 0, n_trajectories), greedy_policy(value_function, config=c), return_velocity=True, config=c)
+        # Band of the optimal trajectories, widened and kept in the reachable states
+        lows = np.stack([np.min(x, axis=0), np.min(v, axis=0)], axis=-1) - margin*level.spacings
+        highs = np.stack([np.max(x, axis=0), np.max(v, axis=0)], axis=-1) + margin*level.spacings
+        level = GridValueFunction(np.clip(lows, boxes[..., 0], boxes[..., 1]), np.clip(highs, boxes[..., 0], boxes[..., 1]), (resolution, resolution))
+    return value_function, greedy_policy(value_function, config=c)
+
+
+# Accuracy
+
+def cost_gap_report(resolutions=(9, 17, 33, 65), levels=(1, 3), exact=True, n_episodes=50, config=None, **solver_options):
+    """ Compares coarse-to-fine solutions with the solution of dp_solver.solve_dp on the exact grid and with the analytical solution.
+    Each policy is simulated from n_episodes initial positions evenly spread in [-1, 0] (see evaluation.evaluate_batch).
+
+    :param (iterable[int], optional) resolutions: Resolutions of the coarse-to-fine solutions. Defaults to (9, 17, 33, 65).
+    :param (iterable[int], optional) levels: Numbers of levels of the coarse-to-fine solutions. Defaults to (1, 3).
+    :param (bool, optional) exact: Whether to solve on the exact grid, which is only tractable for small N and N_U. Defaults to True.
+    :return list[dict]: One row per solution (the exact grid one being first, if any), with its solve time in seconds, the size of its tables in bytes,
+    its mean cost, the mean regret with respect to the optimum of the continuous problem (analytical.optimal_cost) and of the discretized problem,
+    and the gap between its mean cost and the one of the exact grid solution (nan without it).
+    """
+    c = p.get_config(config)
+    rows = []
+    def add_row(name, resolution, n_levels, solve_time, nbytes, policy):
+        evaluation = evaluate_batch(policy, n_episodes=n_episodes, config=c)
+        rows.append({
+            "solver": name,
+            "resolution": resolution,
+            "levels": n_levels,
+            "solve_time": solve_time,
+            "nbytes": nbytes,
+            "cost": float(np.mean(evaluation["costs"])),
+            "regret": evaluation["mean_regret"],
+            "discretized_regret": float(np.mean(evaluation["discretized_regrets"])),
+            "exact_grid_gap": np.nan
+        })
+        if exact:
+            rows[-1]["exact_grid_gap"] = rows[-1]["cost"] - rows[0]["cost"]
+    if exact:
+        from dp_solver import solve_dp, policy_from_array
+        start = time.perf_counter()
+        V, optimal_policy_array = solve_dp(storage="banded", keep_value_function=False, config=c)
+        add_row("exact_grid", None, None, time.perf_counter() - start, V.nbytes + optimal_policy_array.nbytes, policy_from_array(optimal_policy_array, config=c))
+    for resolution in resolutions:
+        for n_levels in levels:
+            start = time.perf_counter()
+            value_function, policy = solve_coarse_to_fine(resolution=resolution, levels=n_levels, config=c, **solver_options)
+            add_row("coarse_to_fine", resolution, n_levels, time.perf_counter() - start, value_function.nbytes, policy)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares coarse-to-fine DP solutions of the cart problem with the exact grid and analytical solutions.")
+    parser.add_argument("--N", type=int, default=p.N, help="Number of time steps.")
+    parser.add_argument("--N_U", type=int, default=p.N_U, help="Resolution of the control.")
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[9, 17, 33, 65], help="Resolutions of the coarse-to-fine grids.")
+    parser.add_argument("--levels", nargs="+", type=int, default=[1, 3], help="Numbers of levels of the coarse-to-fine solutions.")
+    parser.add_argument("--no-exact", action="store_true", help="Skips the exact grid solution, which is intractable for large N.")
+    args = parser.parse_args()
+    config = p.get_config().replace(N=args.N, N_U=args.N_U)
+    for row in cost_gap_report(resolutions=args.resolutions, levels=args.levels, exact=not args.no_exact, config=config):
+        print(", ".join(f"{name}: {value:.4g}" if isinstance(value, float) else f"{name}: {value}" for name, value in row.items()))
@@ -1,65 +1,184 @@
 import os
 import json
+import time
 import gymnasium as gym
 import numpy as np
 import params as p
 from stable_baselines3.common.env_util import make_vec_env
-from stable_baselines3.common.callbacks import EvalCallback
-from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.callbacks import BaseCallback, EvalCallback
+from stable_baselines3.common.evaluation import evaluate_policy
+from stable_baselines3.common.monitor import Monitor, ResultsWriter
+from stable_baselines3.common.vec_env import VecMonitor
+from problem import running_cost, final_cost  # Costs for the dynamic programming formulation, also used as rewards
+from problem import reachable_x, reachable_v, problem_parameters  # Defined with the problem so that the solvers do not import stable-baselines3, kept here for compatibility
+from cart_vec_env import CartVecEnv
+from log_store import migrate_logs
+from evaluation import evaluate_model
+from instrumentation import instrument
 
 
-# Costs
-def  running_cost(x_n, v_n, a_n):
-    """ Running cost for the dynamic programming formulation. """
-    return p.DT*a_n**2
+ENV_ID = "cart_env:AcceleratedCart-v1"  # The module prefix makes gymnasium import cart_env, which registers the env, including in subprocesses
 
-def  final_cost(x_N, v_N):
-    """ Final cost for the dynamic programming formulation. """
-    return p.LAMBDA_P*x_N**2 + p.LAMBDA_V*v_N**2
 
+# Reinforcement learning utilitaries
+def make_cart_env(n_envs=None, monitor_dir=None, override_existing=True, native_vec_env=False, vec_env_cls=None, config=None):
+    """ Creates the environment used to train an RL model on the cart problem, with monitoring logs written in monitor_dir.
 
-# Reachable states for dynamic programming
-def reachable_x(t):
-    """ Returns the set of positions that are reachable in time t from x_0 varying in [-1, 0].
-    Useful in dynamic programming for computing the value function only on relevant states. """
-    return np.arange(-1 + p.U_L*(t**2)/(2*p.M_REAL), p.U_R*(t**2)/(2*p.M_REAL) + p.DX/2, p.DX)
+    :param (int, optional) n_envs: The number of envs to use for parallelized training. If None, a single Monitor-wrapped env is returned. Defaults to None.
+    :param (string, optional) monitor_dir: Path to the folder where monitoring logs are written. If None, no logs are written. Defaults to None.
+    :param (bool, optional) override_existing: Whether to override existing monitoring logs rather than appending to them. Defaults to True.
+    :param (bool, optional) native_vec_env: If True, the n_envs environments are simulated at once by a CartVecEnv (wrapped in a VecMonitor)
+    instead of separate CartEnv objects. Defaults to False.
+    :param (type, optional) vec_env_cls: The VecEnv class running the separate CartEnv objects, e.g. SubprocVecEnv to step them in subprocesses.
+    If None, uses DummyVecEnv. Defaults to None.
+    :param (ProblemConfig, optional) config: Parameters of the problem simulated by the environments. If None, uses the current config. Defaults to None.
+    :rtype: gym.Env or stable_baselines3 VecEnv.
+    """
+    config = p.get_config(config)
+    if native_vec_env:
+        env = VecMonitor(CartVecEnv(n_envs=1 if n_envs is None else n_envs, config=config))
+        if monitor_dir is not None:
+            env.results_writer = ResultsWriter(os.path.join(monitor_dir, "vec"), header={"t_start": env.t_start, "env_id": "AcceleratedCart-v1"}, override_existing=override_existing)
+        return env
+    if n_envs is None:
+        return Monitor(gym.make(ENV_ID, render_mode=None, config=config), filename=monitor_dir, override_existing=override_existing)
+    return make_vec_env(ENV_ID, n_envs=n_envs, monitor_dir=monitor_dir, monitor_kwargs=dict(override_existing=override_existing), env_kwargs=dict(render_mode=None, config=config), vec_env_cls=vec_env_cls)
 
-def reachable_v(t):
-    """ Returns the set of velocities that are reachable in time t from a null velocity at time 0.
-    Useful in dynamic programming for computing the value function only on relevant states. """
-    return np.arange(p.U_L/p.M_REAL*t, p.U_R/p.M_REAL*t + p.DV/2, p.DV)
 
+# Training logs
+class _StoreEvaluations:
+    """ Evaluation logic shared by StoreEvalCallback and BatchEvalCallback: every eval_freq calls, the model is evaluated
+    (by the _evaluate method of the subclass, which returns the accumulated rewards and lengths of the episodes),
+    saved as best_model if its mean reward beats the best one so far (by _save_best_model), and the evaluation is written to an evaluation store
+    (see log_store.evaluation_store) as soon as it is made, instead of rewriting an evaluations.npz file with the whole history at every evaluation.
+    The best mean reward is read from the summary of the store, so that a resumed training only saves a best model if it beats the previous trainings.
+    Since evaluations made in an eval env (from random initial positions) and batched evaluations (from fixed ones) are not comparable,
+    each kind of evaluation keeps its own best mean reward in the summary, under keys prefixed by summary_prefix. """
+    summary_prefix = ""
+
+    def _init_store(self, store):
+        self.store = store
+        self.best_mean_reward = store.summary.get(f"{self.summary_prefix}best_mean_reward", -np.inf)
+        self.last_mean_reward = -np.inf
+
+    def _save_best_model(self):
+        if self.best_model_save_path is not None:
+            self.model.save(os.path.join(self.best_model_save_path, "best_model"))
+
+    def _on_evaluation(self, new_best):
+        """ Called after each evaluation, returning whether the training should continue. """
+        return True
+
+    def _on_step(self):
+        continue_training = True
+        if self.eval_freq > 0 and self.n_calls % self.eval_freq == 0:
+            episode_rewards, episode_lengths = self._evaluate()
+            mean_reward = float(np.mean(episode_rewards))
+            self.last_mean_reward = mean_reward
+            new_best = mean_reward > self.best_mean_reward
+            if new_best:
+                self._save_best_model()
+                self.best_mean_reward = mean_reward
+                self.store.update_summary(**{f"{self.summary_prefix}best_mean_reward": mean_reward, f"{self.summary_prefix}best_timesteps": self.num_timesteps})
+            self.store.append(timesteps=self.num_timesteps, results=np.asarray(episode_rewards, dtype=np.float64), ep_lengths=np.asarray(episode_lengths, dtype=np.int64))
+
+            if self.verbose >= 1:
+                print(f"Eval num_timesteps={self.num_timesteps}, episode_reward={mean_reward:.2f} +/- {np.std(episode_rewards):.2f}")
+            self.logger.record("eval/mean_reward", mean_reward)
+            self.logger.record("eval/mean_ep_length", np.mean(episode_lengths))
+            self.logger.record("time/total_timesteps", self.num_timesteps, exclude="tensorboard")
+            self.logger.dump(self.num_timesteps)
+            continue_training = self._on_evaluation(new_best)
+        return continue_training
+
+    def _on_training_end(self):
+        self.store.flush()
+
+
+class StoreEvalCallback(_StoreEvaluations, EvalCallback):
+    """ EvalCallback running the evaluation episodes one at a time in eval_env, and writing them to an evaluation store (see _StoreEvaluations). """
+
+    def __init__(self, store, eval_env, **kwargs):
+        super().__init__(eval_env, log_path=None, **kwargs)
+        self._init_store(store)
+
+    def _evaluate(self):
+        """ Runs the evaluation episodes, returning their accumulated rewards and lengths. """
+        return evaluate_policy(
+            self.model, self.eval_env, n_eval_episodes=self.n_eval_episodes, render=self.render,
+            deterministic=self.deterministic, return_episode_rewards=True, warn=self.warn
+        )
+
+    def _on_evaluation(self, new_best):
+        continue_training = True
+        if new_best and self.callback_on_new_best is not None:
+            continue_training = self.callback_on_new_best.on_step()
+        if self.callback is not None:
+            continue_training = continue_training and self._on_event()
+        return continue_training
 
-# Reinforcement learning utilitaries
-def replace_best_model(model_path):
-    """ When resuming the training of an RL model, this function is used to update the best stored 
-    model with the one obtained with the new training, if necessary. """
-    previous_best_score = np.max(np.mean(np.load(os.path.join(model_path, "old_evaluations.npz"))["results"], axis=-1))
-    new_best_score = np.max(np.mean(np.load(os.path.join(model_path, "evaluations.npz"))["results"], axis=-1))
-    if new_best_score <= previous_best_score:
-        print("No improvement made from previous training.")
-        os.remove(os.path.join(model_path, "best_model.zip"))
-        os.rename(os.path.join(model_path, "old_best_model.zip"),os.path.join(model_path, "best_model.zip"))
-    else:
-        print("Improvement made from previous training.")
-        os.remove(os.path.join(model_path, "old_best_model.zip"))
 
+class BatchEvalCallback(_StoreEvaluations, BaseCallback):
+    """ Callback running the evaluation episodes as a single batched rollout of the model, from fixed initial positions evenly spread in [-1, 0]
+    (see evaluation.evaluate_batch), and writing them to an evaluation store (see _StoreEvaluations), which needs no eval env.
+    The regrets of the evaluations with respect to the analytical solution are also logged, and the last evaluation is kept in last_evaluation. """
+    summary_prefix = "batch_"
 
-def merge_eval_logs(model_path):
-    """ When resuming the training of an RL model, this function is used to update the previous training logs
-    with the logs obtained from the new training. """
-    old_evaluations = np.load(os.path.join(model_path, "old_evaluations.npz"))
-    new_evaluations = np.load(os.path.join(model_path, "evaluations.npz"))
-    np.savez(
-        os.path.join(model_path, "evaluations"),
-        timesteps=np.append(old_evaluations["timesteps"], new_evaluations["timesteps"]),
-        results=np.append(old_evaluations["results"], new_evaluations["results"], axis=0),
-        ep_lengths=np.append(old_evaluations["ep_lengths"], new_evaluations["ep_lengths"], axis=0)
-    )
-    os.remove(os.path.join(model_path, "old_evaluations.npz"))
+    def __init__(self, store, n_eval_episodes=50, eval_freq=10000, best_model_save_path=None, config=None, verbose=1):
+        """
+        :param EvaluationStore store: The store where evaluations are written, see log_store.evaluation_store.
+        :param (int, optional) n_eval_episodes: Number of evaluation episodes, i.e. of initial positions. Defaults to 50.
+        :param (int, optional) eval_freq: Number of calls of the callback (i.e. of steps of the vectorized training env) between two evaluations. Defaults to 10000.
+        :param (string, optional) best_model_save_path: Folder where the best model is saved. If None, it is not saved. Defaults to None.
+        :param (ProblemConfig, optional) config: Parameters of the problem to evaluate the model on. If None, uses the current config. Defaults to None.
+        :param (int, optional) verbose: If 1, prints the result of each evaluation. Defaults to 1.
+        """
+        super().__init__(verbose)
+        self._init_store(store)
+        self.n_eval_episodes = n_eval_episodes
+        self.eval_freq = eval_freq
+        self.best_model_save_path = best_model_save_path
+        self.config = p.get_config(config)
+        self.last_evaluation = None
 
+    def _init_callback(self):
+        if self.best_model_save_path is not None:
+            os.makedirs(self.best_model_save_path, exist_ok=True)
 
-def instantiate_model(model_name, Algo, hyperparameters, n_envs=None, verbose=0):
+    def _evaluate(self):
+        self.last_evaluation = evaluate_model(self.model, n_episodes=self.n_eval_episodes, config=self.config)
+        self.logger.record("eval/mean_regret", self.last_evaluation["mean_regret"])
+        self.logger.record("eval/max_regret", self.last_evaluation["max_regret"])
+        return self.last_evaluation["rewards"], self.last_evaluation["lengths"]
+
+
+class EpisodeStoreCallback(BaseCallback):
+    """ Callback writing the reward, length and time of the training episodes (as reported by the Monitor or VecMonitor wrappers of the training envs)
+    to a monitor store (see log_store.monitor_store), in place of one monitor.csv file per env.
+    The time of an episode is the time since the start of the training when it ended (rather than the time since the creation of the env, reported by the wrappers),
+    added to the latest time of the previous trainings, so that times keep increasing across resumed trainings. """
+
+    def __init__(self, store, verbose=0):
+        super().__init__(verbose)
+        self.store = store
+        previous_times = store.read("t")
+        self.time_offset = float(np.max(previous_times)) if len(previous_times) > 0 else 0.
+
+    def _on_training_start(self):
+        self._training_start = time.perf_counter()
+
+    def _on_step(self):
+        for info in self.locals["infos"]:
+            if "episode" in info:
+                t = round(self.time_offset + time.perf_counter() - self._training_start, 6)
+                self.store.append(r=float(info["episode"]["r"]), l=int(info["episode"]["l"]), t=t)
+        return True
+
+    def _on_training_end(self):
+        self.store.flush()
+
+
+def instantiate_model(model_name, Algo, hyperparameters, n_envs=None, verbose=0, native_vec_env=False, vec_env_cls=None, config=None):
     """ Creates a folder for the RL model to be trained in the "Agents" folder. This folder will contain the model itself (architecture, weights; best model and latest model),
     the parameters for the cart problem used, the hyperparameters used, monitoring logs for the training and logs for the evaluations made throughout training.
     If the folder already exists, this function simply reloads the existing model.
@@ -70,34 +189,19 @@ def instantiate_model(model_name, Algo, hyperparameters, n_envs=None, verbose=0)
     :param dict hyperparameters: A dictionary containing the hyperparameters to use for the model.
     :param (int, optional) n_envs: The number of envs to use for parallelized training. If None, no parallelization is applied. Defaults to None.
     :param (int, optional) verbose: If 1, will print info on the training process. If 0, only prints evaluation results throughout the training. Defaults to 0.
+    :param (bool, optional) native_vec_env: If True, the envs are simulated at once by a CartVecEnv, which allows for hundreds of parallel envs. Defaults to False.
+    :param (type, optional) vec_env_cls: The VecEnv class running the envs otherwise, e.g. SubprocVecEnv. If None, uses DummyVecEnv. Defaults to None.
+    :param (ProblemConfig, optional) config: Parameters of the cart problem to train on. If None, uses the current config. Defaults to None.
     :return: The model path, created/loaded model and env used for model instanciation.
     :rtype: string, Algo, gym.Env.
     """
     model_path = os.path.join("Agents", model_name)
     existing_model = os.path.exists(model_path)
-    current_problem_parameters = {
-        "M_REAL": p.M_REAL,
-        "LAMBDA_P": p.LAMBDA_P,
-        "LAMBDA_V": p.LAMBDA_V,
-        "T": p.T,
-        "N": p.N,
-        "U_L": p.U_L,
-        "U_R": p.U_R,
-        "N_U": p.N_U,
-        "V_L": p.V_L,
-        "V_R": p.V_R,
-        "N_V": p.N_V,
-        "X_L": p.X_L,
-        "X_R": p.X_R,
-        "N_X": p.N_X
-    }
+    current_problem_parameters = problem_parameters(config)
 
     if existing_model:
         print("Loading a pre-existing model.")
-        if n_envs is None:
-            env = Monitor(gym.make("AcceleratedCart-v1", render_mode=None), filename=model_path, override_existing=False)
-        else:
-            env = make_vec_env("AcceleratedCart-v1", n_envs=n_envs, monitor_dir=model_path, monitor_kwargs=dict(override_existing=False), env_kwargs=dict(render_mode=None))
+        env = make_cart_env(n_envs, native_vec_env=native_vec_env, vec_env_cls=vec_env_cls, config=config)
         model = Algo.load(os.path.join(model_path, "latest_model"), env=env, verbose=verbose)
         
         with open(os.path.join(model_path, "hyperparameters.json"), "r") as hyperparameters_file:
@@ -109,10 +213,7 @@ def instantiate_model(model_name, Algo, hyperparameters, n_envs=None, verbose=0)
     else:
         print("Creating a new model.")
         os.makedirs(model_path)
-        if n_envs is None:
-            env = Monitor(gym.make("AcceleratedCart-v1", render_mode=None), filename=model_path, override_existing=True)
-        else:
-            env = make_vec_env("AcceleratedCart-v1", n_envs=n_envs, monitor_dir=model_path, monitor_kwargs=dict(override_existing=True), env_kwargs=dict(render_mode=None))
+        env = make_cart_env(n_envs, native_vec_env=native_vec_env, vec_env_cls=vec_env_cls, config=config)
 
         with open(os.path.join(model_path, "hyperparameters.json"), "w") as hyperparameters_file:
             # TODO: parse hyperparameters dictionary
@@ -128,31 +229,47 @@ def instantiate_model(model_name, Algo, hyperparameters, n_envs=None, verbose=0)
     return model_path, model, env
 
 
-def train_model(model, model_path, training_steps=50_000, eval_freq=500, n_envs=1):
-    """ Trains the specified model (name and path), running n_envs training episodes simultaneously.
+def train_model(model, model_path, training_steps=50_000, eval_freq=500, config=None, batch_eval=True, instrumentation=False):
+    """ Trains the specified model (name and path) in its env, which runs as many training episodes simultaneously as it has parallel envs.
     Training stops after training_steps time steps have been simulated, counting each parallel episode independantly.
-    Evaluations are carried out every n_envs*eval_freq time steps, evaluating on 50 episodes. """
-    old_eval_logs = os.path.exists(os.path.join(model_path, "evaluations.npz")) and os.path.exists(os.path.join(model_path, "best_model.zip"))
-    assert os.path.exists(os.path.join(model_path, "best_model.zip")) == old_eval_logs and os.path.exists(os.path.join(model_path, "evaluations.npz")) == old_eval_logs
-    if old_eval_logs:
-        os.rename(os.path.join(model_path, "evaluations.npz"), os.path.join(model_path, "old_evaluations.npz"))
-        os.rename(os.path.join(model_path, "best_model.zip"), os.path.join(model_path, "old_best_model.zip"))
-        model.env = make_vec_env("AcceleratedCart-v1", n_envs=n_envs, monitor_dir=model_path, monitor_kwargs=dict(override_existing=False), env_kwargs=dict(render_mode=None))
-
-    # Separate evaluation env
-    eval_env = make_vec_env("AcceleratedCart-v1", n_envs=1, env_kwargs=dict(render_mode=None))
-    # Use deterministic actions for evaluation
-    eval_callback = EvalCallback(eval_env, best_model_save_path=model_path, log_path=model_path, eval_freq=eval_freq, n_eval_episodes=50, deterministic=True, render=False)
+    Evaluations are carried out every eval_freq steps of the env (i.e. every n_envs*eval_freq time steps), evaluating on 50 episodes. With batch_eval, these episodes start from fixed initial positions
+    evenly spread in [-1, 0] and are simulated at once (see BatchEvalCallback); otherwise they are run one at a time in a separate eval env, from random initial positions.
+    Evaluations and training episodes are appended to the stores of log_store in model_path/logs as they happen, so resuming a training
+    (which is detected from the evaluation store) does not copy the logs of the previous trainings. Logs of models trained before these stores
+    were used are imported first.
+    The training and evaluation envs simulate the problem given by config (or the current one if None), which should be the one used in instantiate_model.
+    With instrumentation, the time spent in each phase of the training is appended to model_path/logs/instrumentation.jsonl every 10 seconds,
+    and creating the file model_path/logs/profile_trigger profiles the next training steps (see instrumentation.InstrumentationCallback). """
+    evaluations, episodes = migrate_logs(model_path)
+    resumed = len(evaluations) > 0
+
+    if batch_eval:
+        eval_callback = BatchEvalCallback(evaluations, n_eval_episodes=50, config=config, best_model_save_path=model_path, eval_freq=eval_freq)
+    else:
+        # Separate evaluation env
+        eval_env = make_vec_env(ENV_ID, n_envs=1, env_kwargs=dict(render_mode=None, config=config))
+        # Use deterministic actions for evaluation
+        eval_callback = StoreEvalCallback(evaluations, eval_env, best_model_save_path=model_path, eval_freq=eval_freq, n_eval_episodes=50, deterministic=True, render=False)
+    callbacks = [eval_callback, EpisodeStoreCallback(episodes)]
+    env = model.env
+    instrumentation_callback = instrument(model, os.path.join(model_path, "logs", "instrumentation.jsonl"), eval_callback=eval_callback) if instrumentation else None
+    if instrumentation_callback is not None:
+        callbacks.append(instrumentation_callback)
     try:
-        model.learn(training_steps, eval_callback, reset_num_timesteps=not old_eval_logs, log_interval=None)
+        model.learn(training_steps, callbacks, reset_num_timesteps=not resumed, log_interval=None)
     except KeyboardInterrupt:
         print("Training interrupted by keyboard.")
     finally:
         print("End of learning.")
-
-        if old_eval_logs:
-            replace_best_model(model_path)
-            merge_eval_logs(model_path)
+        evaluations.flush()
+        episodes.flush()
+        model.env = env  # Removes the instrumentation wrapper, if any
 
         # Save latest model, for example to resume trainng later.
-        model.save(os.path.join(model_path, "latest_model"))
+        if instrumentation_callback is None:
+            model.save(os.path.join(model_path, "latest_model"))
+        else:
+            # The save happens after the end of the training, so its metrics are flushed once more
+            with instrumentation_callback.timers.time("save"):
+                model.save(os.path.join(model_path, "latest_model"))
+            instrumentation_callback.flush()
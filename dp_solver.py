@@ -0,0 +1,118 @@
+import numpy as np
+import params as p
+from problem import dynamics, running_cost, final_cost, reachable_x, reachable_v
+from dp_storage import BandedArray
+from grid import grid_mapper, from_arr_a
+
+
+# Grid helpers
+
+def grid_shape(config=None):
+    """ Returns the number of positions and velocities of the discretized state space, i.e. the last two dimensions of the value function. """
+    return grid_mapper(config).shape
+
+
+def reachable_band(n, config=None):
+    """ Returns the positions and velocities that are reachable at time step n, together with the slices of indices they cover in the value function.
+    The reachable states are spaced by DX and DV, which differ from the steps of the grid unless M_REAL is 1, so that several of them may be rounded
+    to the same grid point, or some grid points of the slices may not be reached. """
+    c = p.get_config(config)
+    xs, vs = reachable_x(n*c.DT, config=c), reachable_v(n*c.DT, config=c)
+    grid = grid_mapper(c)
+    return xs, vs, slice(grid.x.to_index(xs[0]), grid.x.to_index(xs[-1])+1), slice(grid.v.to_index(vs[0]), grid.v.to_index(vs[-1])+1)
+
+
+def banded_array(n_steps, dtype=np.float32, fill_value=np.inf, stored_steps=None, config=None):
+    """ Creates a BandedArray indexed like the value function, storing for each of the n_steps first time steps only the band of reachable states.
+
+    :param int n_steps: Number of time steps of the array.
+    :param (np.dtype, optional) dtype: Data type of the stored values. Defaults to np.float32.
+    :param (optional) fill_value: Value of the entries outside of the bands. Defaults to np.inf.
+    :param (iterable[int], optional) stored_steps: Time steps for which a band is stored, the other ones being left empty. If None, all time steps are stored. Defaults to None.
+    :param (ProblemConfig, optional) config: Parameters of the problem, which define the grid and the bands. If None, uses the current config. Defaults to None.
+    """
+    stored_steps = range(n_steps) if stored_steps is None else set(stored_steps)
+    offsets, band_shapes = np.zeros((n_steps, 2), dtype=np.int64), np.zeros((n_steps, 2), dtype=np.int64)
+    for n in stored_steps:
+        _, _, slice_x, slice_v = reachable_band(n, config=config)
+        offsets[n] = slice_x.start, slice_v.start
+        band_shapes[n] = slice_x.stop - slice_x.start, slice_v.stop - slice_v.start
+    return BandedArray((n_steps, *grid_shape(config)), offsets, band_shapes, dtype=dtype, fill_value=fill_value)
+
+
+def action_from_index(a_arr, config=None):
+    """ Converts action indices, as stored in banded policy arrays, into actions. Negative indices (unreachable states) are mapped to np.inf. """
+    return np.where(a_arr >= 0, from_arr_a(a_arr, config=config), np.inf)[()]
+
+
+# Dynamic programming
+
+def solve_dp(max_batch_size=2**22, storage="dense", keep_value_function=True, config=None):
+    """ Solves the discretized control problem by dynamic programming, computing the value function backwards in time.
+    Each time step is computed as one batched NumPy operation over the reachable (x, v) grid and all the actions of the action space.
+    To bound memory usage, the reachable positions are processed in chunks so that at most max_batch_size (x, v, a) triplets are evaluated at once.
+
+    :param (int, optional) max_batch_size: Maximal number of (x, v, a) triplets evaluated in a single batch. Defaults to 2**22.
+    :param (string, optional) storage: Either "dense", to store V and the optimal policy in np.ndarrays of float64 covering the whole state space,
+    or "banded", to store them in BandedArrays only covering the reachable states at each time step, with V in float32 and the policy as int8 action indices
+    (see action_from_index). Defaults to "dense".
+    :param (bool, optional) keep_value_function: If False, the value function is only stored for time step 0, which leaves most of the memory to the policy.
+    Only used with banded storage. Defaults to True.
+    :param (ProblemConfig, optional) config: Parameters of the problem to solve. If None, uses the current config. Defaults to None.
+    :return: The value function V and the optimal policy array, of dimensions (N+1) x X_size x V_size and N x X_size x V_size respectively.
+    Values for states that are not reachable are set to np.inf (or -1 for banded action indices).
+    :rtype: np.ndarray[float] or BandedArray, np.ndarray[float] or BandedArray
+    """
+    c = p.get_config(config)
+    grid = grid_mapper(c)
+    X_size, V_size = grid.shape
+    action_space = np.arange(c.U_L, c.U_R+c.DU, c.DU)
+    if storage == "dense":
+        V = np.inf*np.ones((c.N+1, X_size, V_size))
+        optimal_policy_array = np.inf*np.ones((c.N, X_size, V_size))
+    elif storage == "banded":
+        V = banded_array(c.N+1, dtype=np.float32, fill_value=np.inf, stored_steps=None if keep_value_function else [0], config=c)
+        a_arr_dtype = np.int8 if action_space.shape[0] <= np.iinfo(np.int8).max else np.int16
+        optimal_policy_array = banded_array(c.N, dtype=a_arr_dtype, fill_value=-1, config=c)
+    else:
+        raise ValueError(f"Unknown storage {storage}, expected \"dense\" or \"banded\".")
+
+    # The states reached from the band of time step n always lie in the band of time step n+1, so that only the latter is needed to compute the former.
+    # Values are written at the grid points the reachable states are rounded to, the last state rounded to a grid point giving its value,
+    # and the grid points of a band that no reachable state is rounded to keep an infinite value.
+    xs, vs, slice_x, slice_v = reachable_band(c.N, config=c)
+    next_values = np.full((slice_x.stop - slice_x.start, slice_v.stop - slice_v.start), np.inf)
+    next_values[np.ix_(grid.x.to_index(xs) - slice_x.start, grid.v.to_index(vs) - slice_v.start)] = final_cost(xs[:, None], vs[None, :], config=c)
+    if storage == "dense" or keep_value_function:
+        V[-1, slice_x, slice_v] = next_values
+    for n in range(c.N-1, -1, -1):
+        next_offset_x, next_offset_v = slice_x.start, slice_v.start
+        xs, vs, slice_x, slice_v = reachable_band(n, config=c)
+        arr_xs, arr_vs = grid.x.to_index(xs) - slice_x.start, grid.v.to_index(vs) - slice_v.start
+        values = np.full((slice_x.stop - slice_x.start, slice_v.stop - slice_v.start), np.inf)
+        optimal_a_arrs = np.full(values.shape, -1, dtype=np.intp)
+        chunk_size = max(1, max_batch_size // (vs.shape[0]*action_space.shape[0]))
+        v, a = vs[None, :, None], action_space[None, None, :]
+        for start in range(0, xs.shape[0], chunk_size):
+            x = xs[start:start+chunk_size, None, None]
+            x_new, v_new = dynamics(x, v, a, config=c)
+            total_costs = running_cost(x, v, a, config=c) + next_values[grid.x.to_index(x_new) - next_offset_x, grid.v.to_index(v_new) - next_offset_v]
+            optimal_a_arr = np.argmin(total_costs, axis=-1)
+            indices = np.ix_(arr_xs[start:start+chunk_size], arr_vs)
+            values[indices] = np.take_along_axis(total_costs, optimal_a_arr[..., None], axis=-1)[..., 0]
+            optimal_a_arrs[indices] = optimal_a_arr
+        if storage == "dense" or keep_value_function or n == 0:
+            V[n, slice_x, slice_v] = values
+        optimal_policy_array[n, slice_x, slice_v] = action_from_index(optimal_a_arrs, config=c) if storage == "dense" else optimal_a_arrs
+        next_values = values
+    return V, optimal_policy_array
+
+
+def policy_from_array(optimal_policy_array, config=None):
+    """ Turns an optimal policy array, as returned by solve_dp, into a policy that can be used by problem.simulator.
+    The policy also accepts arrays of times, positions and velocities, so that it can be queried for a batch of states at once (e.g. by problem.batch_simulator),
+    and returns np.inf for states out of the grid. The config must be the one the array was computed for (the current one if None). """
+    grid = grid_mapper(config)
+    if isinstance(optimal_policy_array, BandedArray):
+        return lambda t, x, v: action_from_index(grid.nearest(optimal_policy_array, t, x, v, fill_value=-1), config=grid.config)
+    return lambda t, x, v: grid.nearest(optimal_policy_array, t, x, v)
@@ -0,0 +1,127 @@
+import os
+import json
+import numpy as np
+
+
+class BandedArray:
+    """ Compact storage for arrays indexed like the value function of dynamic programming, i.e. V[n, to_arr_x(x), to_arr_v(v)].
+    For each time step n, only a rectangular band of (x, v) indices is stored (typically the reachable states at that time step);
+    reading outside of this band returns fill_value, and the data of all the bands is kept in a single flat array.
+
+    Indexing supports V[n, ix, iv] where n is an integer or a slice, and ix, iv are integers, slices or integer arrays.
+    Integer arrays are broadcast together as with NumPy advanced indexing, while slices are combined with the other axis as an outer product.
+    n can also be an integer array, e.g. to read a batch of states at different time steps, in which case ix and iv must be integers or integer arrays.
+    """
+
+    def __init__(self, shape, offsets, band_shapes, dtype=np.float32, fill_value=np.inf, data=None):
+        """
+        :param tuple shape: Shape (n_steps, X_size, V_size) of the equivalent dense array.
+        :param offsets: For each time step, index of the first position and velocity of the band.
+        :type offsets: np.ndarray[int] of dimension n_steps x 2.
+        :param band_shapes: For each time step, number of positions and velocities of the band.
+        :type band_shapes: np.ndarray[int] of dimension n_steps x 2.
+        :param (np.dtype, optional) dtype: Data type of the stored values. Defaults to np.float32.
+        :param (optional) fill_value: Value of the entries outside of the bands. Defaults to np.inf.
+        :param (np.ndarray, optional) data: Flat array containing the data of all bands (it can be a np.memmap). If None, the bands are initialized with fill_value.
+        """
+        self.shape = tuple(shape)
+        self.offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+        self.band_shapes = np.asarray(band_shapes, dtype=np.int64).reshape(-1, 2)
+        assert self.offsets.shape[0] == self.band_shapes.shape[0] == self.shape[0]
+        self.dtype = np.dtype(dtype)
+        self.fill_value = fill_value
+        sizes = np.prod(self.band_shapes, axis=1)
+        self._starts = np.concatenate([[0], np.cumsum(sizes)])
+        if data is None:
+            data = np.full(self._starts[-1], fill_value, dtype=self.dtype)
+        assert data.shape == (self._starts[-1],)
+        self.data = data
+
+    @property
+    def nbytes(self):
+        """ Number of bytes used to store the bands. """
+        return self.data.nbytes
+
+    def band(self, n):
+        """ Returns a (writable) view on the band stored for time step n, of dimension band_shapes[n]. """
+        n = range(self.shape[0])[n]
+        return self.data[self._starts[n]:self._starts[n+1]].reshape(self.band_shapes[n])
+
+    def to_dense(self):
+        """ Returns the equivalent dense array. """
+        dense = np.full(self.shape, self.fill_value, dtype=self.dtype)
+        for n in range(self.shape[0]):
+            (ox, ov), (sx, sv) = self.offsets[n], self.band_shapes[n]
+            dense[n, ox:ox+sx, ov:ov+sv] = self.band(n)
+        return dense
+
+    def _local_indices(self, n, ix, iv):
+        """ Converts global indices for time step n into indices in the band, with a mask of the indices that lie in the band. """
+        slices = [isinstance(i, slice) for i in (ix, iv)]
+        ix, iv = [np.arange(self.shape[axis])[i] if isinstance(i, slice) else np.asarray(i) for axis, i in ((1, ix), (2, iv))]
+        if any(slices):
+            squeezed = tuple(axis for axis, i in enumerate((ix, iv)) if i.ndim == 0)
+            ix, iv = np.ix_(np.atleast_1d(ix), np.atleast_1d(iv))
+        else:
+            squeezed = ()
+        ix = np.where(ix < 0, ix + self.shape[1], ix) - self.offsets[n, 0]
+        iv = np.where(iv < 0, iv + self.shape[2], iv) - self.offsets[n, 1]
+        ix, iv = np.broadcast_arrays(ix, iv)
+        inside = (ix >= 0) & (ix < self.band_shapes[n, 0]) & (iv >= 0) & (iv < self.band_shapes[n, 1])
+        return ix, iv, inside, squeezed
+
+    def _gather(self, n, ix, iv):
+        """ Reads the entries (n, ix, iv) for integer arrays n, ix and iv broadcast together, each entry being read in the band of its own time step. """
+        n, ix, iv = np.broadcast_arrays(np.asarray(n), np.asarray(ix), np.asarray(iv))
+        n = np.where(n < 0, n + self.shape[0], n)
+        ix = np.where(ix < 0, ix + self.shape[1], ix) - self.offsets[n, 0]
+        iv = np.where(iv < 0, iv + self.shape[2], iv) - self.offsets[n, 1]
+        inside = (ix >= 0) & (ix < self.band_shapes[n, 0]) & (iv >= 0) & (iv < self.band_shapes[n, 1])
+        values = np.full(n.shape, self.fill_value, dtype=self.dtype)
+        values[inside] = self.data[self._starts[n[inside]] + ix[inside]*self.band_shapes[n[inside], 1] + iv[inside]]
+        return values[()]
+
+    def __getitem__(self, key):
+        n, ix, iv = key
+        if isinstance(n, np.ndarray) and n.ndim > 0:
+            return self._gather(n, ix, iv)
+        if isinstance(n, slice):
+            return np.stack([self[m, ix, iv] for m in range(self.shape[0])[n]])
+        n = range(self.shape[0])[n]
+        ix, iv, inside, squeezed = self._local_indices(n, ix, iv)
+        if np.all(inside):
+            values = self.band(n)[ix, iv]
+        else:
+            values = np.full(ix.shape, self.fill_value, dtype=self.dtype)
+            values[inside] = self.band(n)[ix[inside], iv[inside]]
+        return values.squeeze(axis=squeezed)[()]
+
+    def __setitem__(self, key, value):
+        n, ix, iv = key
+        n = range(self.shape[0])[n]
+        ix, iv, inside, squeezed = self._local_indices(n, ix, iv)
+        if not np.all(inside):
+            raise IndexError(f"Cannot write outside of the band stored for time step {n}.")
+        value = np.broadcast_to(np.asarray(value, dtype=self.dtype), inside.squeeze(axis=squeezed).shape).reshape(ix.shape)
+        self.band(n)[ix, iv] = value
+
+    def save(self, directory, name):
+        """ Saves the array in the given directory, as a flat .npy file for the data of the bands and a .json file for their layout. """
+        np.save(os.path.join(directory, f"{name}.npy"), self.data)
+        layout = {
+            "shape": self.shape,
+            "offsets": self.offsets.tolist(),
+            "band_shapes": self.band_shapes.tolist(),
+            "dtype": self.dtype.str,
+            "fill_value": self.fill_value.item() if isinstance(self.fill_value, np.generic) else self.fill_value
+        }
+        with open(os.path.join(directory, f"{name}_layout.json"), "w") as layout_file:
+            json.dump(layout, layout_file)
+
+    @classmethod
+    def load(cls, directory, name, mmap_mode=None):
+        """ Loads an array saved with BandedArray.save. With mmap_mode="r", the data of the bands is memory-mapped instead of being read from disk. """
+        with open(os.path.join(directory, f"{name}_layout.json"), "r") as layout_file:
+            layout = json.load(layout_file)
+        data = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+        return cls(layout["shape"], layout["offsets"], layout["band_shapes"], dtype=layout["dtype"], fill_value=layout["fill_value"], data=data)
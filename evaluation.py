@@ -0,0 +1,69 @@
+import time
+import numpy as np
+import params as p
+from problem import batch_simulator, running_cost, final_cost, trajectory_cost
+from analytical import regret_table
+from policy_export import sb3_policy
+
+
+# Evaluation episodes
+
+def stratified_x_0s(n_episodes=50):
+    """ Initial positions of the evaluation episodes: the centers of n_episodes intervals of equal length splitting [-1, 0].
+    Unlike the random initial positions of CartEnv.reset, they are the same at every evaluation and cover [-1, 0] evenly. """
+    return -(np.arange(n_episodes) + 0.5)/n_episodes
+
+
+# Batched evaluation
+
+def episode_rewards(x, v, u, config=None):
+    """ Accumulated rewards of a batch of episodes, as returned by CartEnv (whose last step is only rewarded with the final cost).
+
+    :param np.ndarray[float] x: Positions of the episodes, of dimension B x (N+1).
+    :param np.ndarray[float] v: Velocities of the episodes, of dimension B x (N+1).
+    :param np.ndarray[float] u: Controls of the episodes, of dimension B x N.
+    :return np.ndarray[float]: The B accumulated rewards.
+    """
+    c = p.get_config(config)
+    return -np.sum(running_cost(x[:, 1:-1], v[:, 1:-1], u[:, :-1], config=c), axis=-1) - final_cost(x[:, -1], v[:, -1], config=c)
+
+
+def evaluate_batch(policy, n_episodes=50, config=None):
+    """ Evaluates a policy on n_episodes episodes run as a single batched rollout, from the initial positions stratified_x_0s(n_episodes),
+    the policy being called once per time step for the whole batch.
+
+    :param function policy: Vectorized policy, as used by problem.batch_simulator (e.g. policy_export.sb3_policy(model)).
+    :param (int, optional) n_episodes: Number of evaluation episodes. Defaults to 50.
+    :param (ProblemConfig, optional) config: Parameters of the problem. If None, uses the current config. Defaults to None.
+    :return dict: The initial positions "x_0", and for each of them the accumulated reward of the episode as in CartEnv ("rewards"), its length ("lengths"),
+    the cost of its trajectory ("costs") and the regrets of this cost with respect to the optimal costs of the continuous and discretized problems
+    ("regrets" and "discretized_regrets", see analytical.regret_table).
+    Also the mean and standard deviation of the rewards, the mean and maximal regrets, and the wall time of the rollout in seconds.
+    """
+    c = p.get_config(config)
+    x_0s = stratified_x_0s(n_episodes)
+    start = time.perf_counter()
+    x, v, u = batch_simulator(x_0s, policy, return_velocity=True, config=c)
+    wall_time = time.perf_counter() - start
+    rewards = episode_rewards(x, v, u, config=c)
+    # Unlike the rewards, the costs include the running cost of the last step
+    costs = trajectory_cost(x, v, u, config=c)
+    regrets = regret_table(costs, x_0s, config=c)
+    return {
+        "x_0": x_0s,
+        "rewards": rewards,
+        "lengths": np.full(n_episodes, c.N),
+        "costs": costs,
+        "regrets": regrets["regret"],
+        "discretized_regrets": regrets["discretized_regret"],
+        "mean_reward": float(np.mean(rewards)),
+        "std_reward": float(np.std(rewards)),
+        "mean_regret": float(np.mean(regrets["regret"])),
+        "max_regret": float(np.max(regrets["regret"])),
+        "wall_time": wall_time
+    }
+
+
+def evaluate_model(model, n_episodes=50, config=None):
+    """ Evaluates a stable-baselines3 model trained on the cart problem with deterministic actions (see evaluate_batch). """
+    return evaluate_batch(sb3_policy(model, config=config), n_episodes=n_episodes, config=config)
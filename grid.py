@@ -0,0 +1,134 @@
+import functools
+import numpy as np
+import params as p
+# Mappings between states and grid indices, which only depend on NumPy, so that solvers and policies can be loaded without the plotting utilities.
+
+
+# Conversion from float to array indices
+
+class GridIndexMapper:
+    """ Maps the values of a uniformly discretized axis (position, velocity or action) to their indices in the arrays of dynamic programming, and back.
+    The affine coefficients are computed once, and all methods convert whole arrays (or scalars) in a single vectorized operation.
+    Conversions give the same results as utils.transform_interval with the same bounds.
+    """
+
+    def __init__(self, low, high, resolution):
+        """
+        :param float low: Lower bound of the axis, mapped to index 0.
+        :param float high: Upper bound of the axis, mapped to the last index.
+        :param float resolution: Number of grid points per unit of the axis.
+        """
+        self.low, self.high = low, high
+        last_index = (high-low)*resolution
+        self.size = int(last_index)+1  # Number of grid points
+        self.scale, self.offset = last_index/(high-low), (0*high-last_index*low)/(high-low)
+        self.inverse_scale, self.inverse_offset = (high-low)/last_index, (low*last_index-high*0)/last_index
+
+    def to_fractional_index(self, values):
+        """ Returns the (non-rounded) position of the values on the grid, in units of indices. """
+        return self.scale*values + self.offset
+
+    def to_index(self, values, clip=False):
+        """ Returns the indices of the nearest grid points (rounding ties to the nearest even index).
+        Out-of-grid values give out-of-range indices, unless clip is True, in which case they are mapped to the closest bound of the grid. """
+        indices = np.rint(self.scale*values + self.offset).astype(np.intp)
+        return np.clip(indices, 0, self.size-1) if clip else indices
+
+    def contains(self, values):
+        """ Returns whether the nearest grid points of the values lie in the grid, i.e. a mask flagging out-of-grid values with False. """
+        indices = self.to_index(values)
+        return (indices >= 0) & (indices < self.size)
+
+    def from_index(self, indices):
+        """ Returns the values of the grid points of given indices. """
+        return self.inverse_scale*indices + self.inverse_offset
+
+
+def bilinear_interpolation(table, n, fx, fv):
+    """ Interpolates bilinearly a table indexed like the value function of dynamic programming (table[n, ix, iv], as a np.ndarray or a dp_storage.BandedArray),
+    at time steps n and fractional indices fx and fv, given as arrays broadcast together. Fractional indices are clipped to the table.
+    The result is infinite if any grid point with a non-null weight is. """
+    n, fx, fv = np.broadcast_arrays(n, fx, fv)
+    x_size, v_size = table.shape[1], table.shape[2]
+    fx, fv = np.clip(fx, 0, x_size-1), np.clip(fv, 0, v_size-1)
+    ix, iv = np.minimum(np.floor(fx).astype(np.intp), x_size-2), np.minimum(np.floor(fv).astype(np.intp), v_size-2)
+    wx, wv = fx - ix, fv - iv
+    values = np.zeros(n.shape)
+    for dx, weight_x in ((0, 1-wx), (1, wx)):
+        for dv, weight_v in ((0, 1-wv), (1, wv)):
+            weight = weight_x*weight_v
+            # Grid points with a null weight are skipped, so that their (possibly infinite) values do not turn the result into nan
+            values += np.multiply(weight, table[n, ix+dx, iv+dv], out=np.zeros(n.shape), where=weight > 0)
+    return values
+
+
+class StateGridMapper:
+    """ Index mappers of the time, position, velocity and action axes of a config, with nearest-neighbor and bilinear lookups
+    in arrays indexed like the value function of dynamic programming (np.ndarray or dp_storage.BandedArray), for batches of states at once.
+    Instances are cached per config, see grid_mapper.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.x = GridIndexMapper(config.X_L, config.X_R, config.N_X)
+        self.v = GridIndexMapper(config.V_L, config.V_R, config.N_V)
+        self.a = GridIndexMapper(config.U_L, config.U_R, config.N_U)
+
+    @property
+    def shape(self):
+        """ Number of positions and velocities of the discretized state space, i.e. the last two dimensions of the value function. """
+        return self.x.size, self.v.size
+
+    def time_index(self, t):
+        """ Returns the time steps of the times t. """
+        return np.rint(np.asarray(t)/self.config.DT).astype(np.intp)[()]
+
+    def nearest(self, table, t, x, v, fill_value=np.inf):
+        """ Reads table at the grid points nearest to the states (t, x, v), given as scalars or arrays broadcast together.
+        States out of the grid are given fill_value. """
+        n, x, v = np.broadcast_arrays(self.time_index(t), x, v)
+        inside = self.x.contains(x) & self.v.contains(v)
+        values = table[n, self.x.to_index(x, clip=True), self.v.to_index(v, clip=True)]
+        return np.where(inside, values, fill_value)[()]
+
+    def bilinear(self, table, t, x, v, fill_value=np.inf):
+        """ Interpolates table bilinearly in (x, v) at the states (t, x, v), given as scalars or arrays broadcast together, t being rounded to the nearest time step.
+        States out of the grid are given fill_value, and the interpolated value is infinite if any grid point with a non-null weight is (e.g. unreachable). """
+        n, x, v = np.broadcast_arrays(self.time_index(t), x, v)
+        inside = self.x.contains(x) & self.v.contains(v)
+        values = bilinear_interpolation(table, n, self.x.to_fractional_index(x), self.v.to_fractional_index(v))
+        return np.where(inside, values, fill_value)[()]
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_grid_mapper(config):
+    return StateGridMapper(config)
+
+def grid_mapper(config=None):
+    """ Returns the StateGridMapper of the given config (or of the current one if None), which is created once per config. """
+    return _cached_grid_mapper(p.get_config(config))
+
+
+def to_arr_x(x, config=None):
+    """ Converts positions (a float or an array) to indices for value functions and policies. """
+    return grid_mapper(config).x.to_index(x)[()]
+
+def from_arr_x(x, config=None):
+    """ Inverse of to_arr_x. """
+    return grid_mapper(config).x.from_index(x)
+
+def to_arr_v(v, config=None):
+    """ Converts velocities (a float or an array) to indices for value functions and policies. """
+    return grid_mapper(config).v.to_index(v)[()]
+
+def from_arr_v(v, config=None):
+    """ Inverse of to_arr_v. """
+    return grid_mapper(config).v.from_index(v)
+
+def to_arr_a(a, config=None):
+    """ Converts actions (a float or an array) to indices for value functions and policies. """
+    return grid_mapper(config).a.to_index(a)[()]
+
+def from_arr_a(a, config=None):
+    """ Inverse of to_arr_a. """
+    return grid_mapper(config).a.from_index(a)
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import cProfile
+import contextlib
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+
+PHASES = ("rollout", "env_step", "env_reset", "update", "eval", "save")
+
+
+class PhaseTimers:
+    """ Accumulates the wall time spent in each phase of a training, with the number of times each phase was entered. """
+
+    def __init__(self):
+        self.totals = dict.fromkeys(PHASES, 0.)
+        self.counts = dict.fromkeys(PHASES, 0)
+
+    def add(self, phase, duration):
+        self.totals[phase] = self.totals.get(phase, 0.) + duration
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    @contextlib.contextmanager
+    def time(self, phase):
+        """ Context manager adding the wall time of its block to the given phase. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def wrap(self, obj, method_name, phase):
+        """ Times every call to a method of an object (e.g. the evaluations of a callback), by replacing the method of this object only. """
+        method = getattr(obj, method_name)
+        def timed_method(*args, **kwargs):
+            with self.time(phase):
+                return method(*args, **kwargs)
+        setattr(obj, method_name, timed_method)
+
+    def snapshot(self):
+        """ Returns the total times and counts by phase. """
+        return {phase: {"total": self.totals[phase], "count": self.counts[phase]} for phase in self.totals}
+
+
+class TimedVecEnv(VecEnvWrapper):
+    """ VecEnv wrapper timing the steps and resets of the wrapped envs (including their Monitor wrappers), in the phases env_step and env_reset of timers. """
+
+    def __init__(self, venv, timers):
+        super().__init__(venv)
+        self.timers = timers
+
+    def reset(self):
+        with self.timers.time("env_reset"):
+            return self.venv.reset()
+
+    def step_async(self, actions):
+        self._step_start = time.perf_counter()
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        observations, rewards, dones, infos = self.venv.step_wait()
+        self.timers.add("env_step", time.perf_counter() - self._step_start)
+        return observations, rewards, dones, infos
+
+
+class InstrumentationCallback(BaseCallback):
+    """ Callback recording the time spent in each phase of the training of an on-policy model (see PHASES), with counters of steps and episodes.
+    The phases do not overlap: evaluations and saves made during a rollout (e.g. by an EvalCallback) are not counted in the rollout phase,
+    whose time is mostly spent in env steps (also counted in env_step if the env is a TimedVecEnv) and in the inference of the policy.
+
+    Metrics are appended as a JSON line to metrics_path every flush_interval seconds and at the end of the training.
+    Creating the file profile_trigger_path (e.g. with touch) while training runs the next profile_steps steps (with their updates) under cProfile,
+    and writes the statistics next to metrics_path, in a .prof file named after the time step where profiling started. The trigger file is then removed.
+    """
+
+    def __init__(self, metrics_path, timers=None, flush_interval=10., profile_trigger_path=None, profile_steps=10_000, verbose=0):
+        """
+        :param string metrics_path: Path to the JSON lines file where metrics are appended.
+        :param (PhaseTimers, optional) timers: Timers shared with the wrappers of the env and of other callbacks. If None, new timers are created. Defaults to None.
+        :param (float, optional) flush_interval: Minimal number of seconds between two writes of the metrics. Defaults to 10.
+        :param (string, optional) profile_trigger_path: Path of the file triggering profiling. If None, profile_trigger next to metrics_path. Defaults to None.
+        :param (int, optional) profile_steps: Number of time steps (counting each parallel env) to profile when triggered. Defaults to 10000.
+        """
+        super().__init__(verbose)
+        self.metrics_path = metrics_path
+        self.timers = timers or PhaseTimers()
+        self.flush_interval = flush_interval
+        self.profile_trigger_path = profile_trigger_path or os.path.join(os.path.dirname(metrics_path), "profile_trigger")
+        self.profile_steps = profile_steps
+        self.episodes = 0
+        self._profiler = None
+        self._profile_start = None
+
+    def _on_training_start(self):
+        os.makedirs(os.path.dirname(self.metrics_path) or ".", exist_ok=True)
+        self._training_start = self._last_flush = time.perf_counter()
+        self._start_timesteps = self.num_timesteps
+        self._phase_start = None
+
+    def _start_phase(self):
+        self._phase_start = time.perf_counter()
+        self._nested_time = self.timers.totals["eval"] + self.timers.totals["save"]
+
+    def _end_phase(self, phase):
+        if self._phase_start is not None:
+            nested_time = self.timers.totals["eval"] + self.timers.totals["save"] - self._nested_time
+            self.timers.add(phase, time.perf_counter() - self._phase_start - nested_time)
+            self._phase_start = None
+
+    def _on_rollout_start(self):
+        self._end_phase("update")
+        self._start_phase()
+
+    def _on_rollout_end(self):
+        self._end_phase("rollout")
+        self._start_phase()
+
+    def _on_step(self):
+        self.episodes += sum("episode" in info for info in self.locals["infos"])
+        if self._profiler is None and os.path.exists(self.profile_trigger_path):
+            self._profiler, self._profile_start = cProfile.Profile(), self.num_timesteps
+            self._profiler.enable()
+        elif self._profiler is not None and self.num_timesteps - self._profile_start >= self.profile_steps:
+            self._stop_profiling()
+        if time.perf_counter() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return True
+
+    def _stop_profiling(self):
+        self._profiler.disable()
+        self._profiler.dump_stats(os.path.join(os.path.dirname(self.metrics_path), f"profile_{self._profile_start}.prof"))
+        self._profiler = None
+        if os.path.exists(self.profile_trigger_path):
+            os.remove(self.profile_trigger_path)
+
+    def _on_training_end(self):
+        self._end_phase("update")
+        if self._profiler is not None:
+            self._stop_profiling()
+        self.flush()
+
+    def flush(self):
+        """ Appends the current metrics to metrics_path: wall time since the start of the training, time steps, episodes, throughput and phase timers. """
+        now = time.perf_counter()
+        metrics = {
+            "time": time.time(),
+            "elapsed": now - self._training_start,
+            "timesteps": self.num_timesteps,
+            "episodes": self.episodes,
+            "steps_per_second": (self.num_timesteps - self._start_timesteps)/max(now - self._training_start, 1e-9),
+            "phases": self.timers.snapshot()
+        }
+        with open(self.metrics_path, "a") as metrics_file:
+            metrics_file.write(json.dumps(metrics) + "\n")
+        self._last_flush = now
+
+
+def instrument(model, metrics_path, eval_callback=None, **kwargs):
+    """ Instruments the training of a model: wraps its env in a TimedVecEnv, times the evaluations and the saves of the best model of eval_callback
+    (a dp_rl.StoreEvalCallback or BatchEvalCallback, if any), and returns the InstrumentationCallback to pass to model.learn along with the other callbacks
+    (see InstrumentationCallback for kwargs). Saves made after the training (e.g. of the latest model) can be timed with the timers of the callback,
+    whose flush method then records them. """
+    timers = PhaseTimers()
+    model.env = TimedVecEnv(model.env, timers)
+    if eval_callback is not None:
+        timers.wrap(eval_callback, "_evaluate", "eval")
+        timers.wrap(eval_callback, "_save_best_model", "save")
+    return InstrumentationCallback(metrics_path, timers=timers, **kwargs)
@@ -0,0 +1,131 @@
+import os
+import json
+import glob
+import numpy as np
+
+
+class RecordStore:
+    """ Append-only columnar store for training logs (e.g. evaluation results or episode records), kept in a folder.
+    Each column is a raw binary file to which rows are appended in chunks of chunk_size rows, so that writing a chunk never rewrites the history.
+    Columns are read lazily with np.memmap, and a small summary (e.g. the best score so far) is cached in a .json file,
+    so that resuming a training only reads this summary and the sizes of the files.
+    If a write is interrupted, the incomplete trailing rows are ignored when reading.
+    """
+
+    def __init__(self, directory, chunk_size=1):
+        """
+        :param string directory: Path to the folder of the store, created when the store is first written.
+        :param (int, optional) chunk_size: Number of rows buffered in memory before being written to disk. Defaults to 1.
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.schema = self._read_json("schema.json", default={})  # dtype and row shape by column
+        self.summary = self._read_json("summary.json", default={})
+        self._buffer = []
+
+    def _read_json(self, name, default):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return default
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+
+    def _write_json(self, name, content):
+        """ Writes a .json file of the store atomically, by writing a temporary file first. """
+        path = os.path.join(self.directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{path}.tmp", "w") as json_file:
+            json.dump(content, json_file)
+        os.replace(f"{path}.tmp", path)
+
+    def _column_path(self, column):
+        return os.path.join(self.directory, f"{column}.bin")
+
+    def _row_size(self, column):
+        """ Number of bytes of a row of the given column. """
+        return np.dtype(self.schema[column]["dtype"]).itemsize*int(np.prod(self.schema[column]["shape"], dtype=np.int64))
+
+    def stored_rows(self):
+        """ Number of complete rows written on disk, computed from the sizes of the column files. """
+        if not self.schema:
+            return 0
+        return min(
+            os.path.getsize(self._column_path(column))//self._row_size(column) if os.path.exists(self._column_path(column)) else 0
+            for column in self.schema
+        )
+
+    def __len__(self):
+        return self.stored_rows() + len(self._buffer)
+
+    def append(self, **row):
+        """ Appends a row, given as one value (scalar or array) per column. The columns and the shape of their values are fixed by the first row ever appended. """
+        if not self.schema:
+            self.schema = {column: {"dtype": np.asarray(value).dtype.str, "shape": list(np.shape(value))} for column, value in row.items()}
+            self._write_json("schema.json", self.schema)
+        if set(row) != set(self.schema) or any(list(np.shape(value)) != self.schema[column]["shape"] for column, value in row.items()):
+            raise ValueError(f"Row {row} does not match the schema {self.schema} of the store.")
+        self._buffer.append(row)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def update_summary(self, **values):
+        """ Updates the cached summary, which is written with the next chunk of rows (or by flush). """
+        self.summary.update(values)
+
+    def flush(self):
+        """ Writes the buffered rows at the end of the column files, then the summary. """
+        if self._buffer:
+            # Rows possibly left incomplete by an interrupted write are discarded, so that all the columns stay aligned
+            n_rows = self.stored_rows()
+            for column, properties in self.schema.items():
+                values = np.asarray([row[column] for row in self._buffer], dtype=properties["dtype"])
+                with open(self._column_path(column), "ab") as column_file:
+                    column_file.truncate(n_rows*self._row_size(column))
+                    column_file.write(values.tobytes())
+            self._buffer = []
+        self._write_json("summary.json", self.summary)
+
+    def read(self, column):
+        """ Returns the rows of a column written on disk, as a read-only np.memmap (or an empty array if there are none). """
+        n_rows = self.stored_rows()
+        shape = (n_rows, *self.schema[column]["shape"]) if column in self.schema else (0,)
+        if n_rows == 0:
+            return np.empty(shape, dtype=self.schema[column]["dtype"] if column in self.schema else float)
+        return np.memmap(self._column_path(column), dtype=self.schema[column]["dtype"], mode="r", shape=shape)
+
+
+# Stores of a trained model
+
+def evaluation_store(model_path, chunk_size=1):
+    """ Store of the evaluations made throughout the training of a model, with columns timesteps, results and ep_lengths (as in evaluations.npz),
+    and the best mean reward so far (with its time step) of each kind of evaluation in its summary (see dp_rl._StoreEvaluations). Each evaluation is written as soon as it is made by default. """
+    return RecordStore(os.path.join(model_path, "logs", "evaluations"), chunk_size=chunk_size)
+
+
+def monitor_store(model_path, chunk_size=1000):
+    """ Store of the training episodes of a model, with columns r, l and t (reward, length and time since the start of the training, as in monitor.csv files),
+    shared by all the training envs. """
+    return RecordStore(os.path.join(model_path, "logs", "monitor"), chunk_size=chunk_size)
+
+
+def migrate_logs(model_path):
+    """ Moves the logs of a model trained before the stores were used (evaluations.npz and *.monitor.csv files) into its stores, if they are empty.
+    The old files are left in place. Returns the evaluation and monitor stores. """
+    evaluations, episodes = evaluation_store(model_path), monitor_store(model_path)
+    npz_path = os.path.join(model_path, "evaluations.npz")
+    if len(evaluations) == 0 and os.path.exists(npz_path):
+        old_evaluations = np.load(npz_path)
+        for timesteps, results, ep_lengths in zip(old_evaluations["timesteps"], old_evaluations["results"], old_evaluations["ep_lengths"]):
+            evaluations.append(timesteps=timesteps, results=results.astype(np.float64), ep_lengths=ep_lengths)
+        mean_results = np.mean(old_evaluations["results"], axis=-1)
+        if mean_results.shape[0] > 0:
+            evaluations.update_summary(best_mean_reward=float(np.max(mean_results)), best_timesteps=int(old_evaluations["timesteps"][np.argmax(mean_results)]))
+        evaluations.flush()
+    monitor_files = sorted(glob.glob(os.path.join(model_path, "*monitor.csv")))
+    if len(episodes) == 0 and monitor_files:
+        # The first line of each file is a json header and the second one the names of the columns r, l and t
+        records = np.concatenate([np.loadtxt(monitor_file, delimiter=",", skiprows=2, ndmin=2).reshape(-1, 3) for monitor_file in monitor_files])
+        for r, l, t in records[np.argsort(records[:, 2], kind="stable")]:
+            episodes.append(r=r, l=int(l), t=t)
+        episodes.flush()
+    return evaluations, episodes
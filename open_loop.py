@@ -0,0 +1,97 @@
+import numpy as np
+import params as p
+from problem import J
+from analytical import ground_truth
+
+
+# Cost of open-loop controls
+
+class OpenLoopEvaluator:
+    """ Evaluates the cost problem.J of piece-wise constant open-loop controls, with its exact gradient and Hessian, using matrix products only.
+    Since the dynamics are linear, the terminal state (x_N, v_N) is an affine function of the control u: (x_N, v_N) = (x_0, 0) + G u,
+    where the 2 x N input-to-terminal-state matrix G only depends on (m, dt, N) and is computed once.
+    All methods accept batches of controls of dimension ... x N, with x_0 broadcast against the leading axes.
+    """
+
+    def __init__(self, m, dt=None, N=None, config=None):
+        """
+        :param float m: The (estimated) mass of the cart.
+        :param (float, optional) dt: Length of a time step. If None, uses the DT of the config. Defaults to None.
+        :param (int, optional) N: Number of time steps. If None, uses the N of the config. Defaults to None.
+        :param (ProblemConfig, optional) config: Parameters of the problem (penalizations, time discretization). If None, uses the current config. Defaults to None.
+        """
+        c = p.get_config(config)
+        self.m = m
+        self.dt = c.DT if dt is None else dt
+        self.N = c.N if N is None else N
+        self.G = np.stack([self.dt**2/m * np.arange(self.N, 0, -1), self.dt/m * np.ones(self.N)])
+        self.D = np.diag([c.LAMBDA_P, c.LAMBDA_V])
+        self._hessian = 2*self.G.T @ self.D @ self.G + 2*self.dt*np.eye(self.N)
+
+    def terminal_state(self, u, x_0):
+        """ Returns the terminal states (x_N, v_N) reached with controls u from initial positions x_0, as an array of dimension ... x 2. """
+        return u @ self.G.T + np.stack(np.broadcast_arrays(x_0, 0.), axis=-1)
+
+    def J(self, u, x_0):
+        """ Cost of the controls u for initial positions x_0 (same as problem.J). """
+        y_N = self.terminal_state(u, x_0)
+        return np.sum(y_N**2 @ self.D, axis=-1) + self.dt*np.sum(u**2, axis=-1)
+
+    def gradient(self, u, x_0):
+        """ Exact gradient of the cost with respect to the controls u, for initial positions x_0. """
+        return 2*(self.terminal_state(u, x_0) @ self.D) @ self.G + 2*self.dt*u
+
+    def J_and_gradient(self, u, x_0):
+        """ Cost and its gradient computed in a single pass, e.g. for scipy.optimize.minimize with jac=True. """
+        y_N = self.terminal_state(u, x_0)
+        Dy_N = y_N @ self.D
+        return np.sum(y_N*Dy_N, axis=-1) + self.dt*np.sum(u**2, axis=-1), 2*Dy_N @ self.G + 2*self.dt*u
+
+    def hessian(self):
+        """ Hessian of the cost with respect to the controls, which is constant since the cost is quadratic. """
+        return self._hessian
+
+
+# Solvers
+
+def solve_open_loop(x_0, m, dt=None, config=None):
+    """ Computes the optimal discrete control for a batch of initial positions x_0 and an estimated mass m, by solving the linear system H u = -grad J(0).
+    Since the cost is quadratic and its gradient at u=0 is linear in x_0, the system is solved once for x_0=1 and the optimal controls of the whole batch are obtained by scaling.
+
+    :param np.ndarray[float] x_0: Initial positions, of any dimension.
+    :param float m: The (estimated) mass of the cart.
+    :param (float, optional) dt: Length of a time step. If None, uses the DT of the config. Defaults to None.
+    :param (ProblemConfig, optional) config: Parameters of the problem. If None, uses the current config. Defaults to None.
+    :return np.ndarray[float]: The optimal controls, of dimension x_0.shape x N where N=T/dt.
+    """
+    c = p.get_config(config)
+    dt = c.DT if dt is None else dt
+    evaluator = OpenLoopEvaluator(m, dt=dt, N=round(c.T/dt), config=c)
+    gain = np.linalg.solve(evaluator.hessian(), -evaluator.gradient(np.zeros(evaluator.N), 1.))
+    return np.multiply.outer(x_0, gain)
+
+
+def solve_by_bfgs(x_0, m, dt=None, config=None):
+    """ Solves the control problem using BFGS (scipy.optimize.minimize), with initial condition x_0 and estimated mass m, using the exact gradient of OpenLoopEvaluator.
+    This is the iterative counterpart of solve_open_loop, for a single initial position. """
+    from scipy.optimize import minimize
+    c = p.get_config(config)
+    dt = c.DT if dt is None else dt
+    evaluator = OpenLoopEvaluator(m, dt=dt, N=round(c.T/dt), config=c)
+    return minimize(evaluator.J_and_gradient, np.zeros(evaluator.N), args=(x_0,), method="BFGS", jac=True).x
+
+
+def cross_check(u, x_0, m=None, config=None):
+    """ Validates open-loop controls u obtained for initial positions x_0 (of dimension ... x N and ... respectively).
+
+    :param (float, optional) m: The mass used to evaluate the cost. If None, uses the real mass M_REAL of the config. Defaults to None.
+    :param (ProblemConfig, optional) config: Parameters of the problem. If None, uses the current config. Defaults to None.
+    :return: The costs of the controls computed by problem.J, and the maximal deviation of each control from the analytical control of the continuous problem
+    (analytical.ground_truth) at the beginning of each time step.
+    :rtype: np.ndarray[float], np.ndarray[float]
+    """
+    c = p.get_config(config)
+    m = c.M_REAL if m is None else m
+    dt = c.T/u.shape[-1]
+    _, _, gt_u = ground_truth(np.expand_dims(x_0, axis=-1), np.arange(u.shape[-1])*dt, config=c)
+    return J(u, x_0, m, dt=dt, config=c), np.max(np.abs(u - gt_u), axis=-1)
@@ -1,23 +1,81 @@
-# Physical problem
-M_REAL = 1      # Mass of the cart
-LAMBDA_P = 100  # Penalization for not reaching the target at time T
-LAMBDA_V = 50   # Penalization for not having null velocity at time T
-T = 1           # Time horizon of the problem
-
-# Time discretization
-N = 50    # Number of time steps for the simulator
-DT = T/N  # Length of a time step
-
-# Space and action discretizations
-U_L, U_R = -6, 6  # Bounds for the control
-N_U = 4  # Resolution of the control
-DU = 1/N_U  # Step between two possible values of the control
-V_L, V_R = U_L/M_REAL*T, U_R/M_REAL*T  # Bounds for the velocity
-DV = DU/M_REAL*DT  # Step between two possible values of the velocity
-N_V = round(1/DV)  # Resolution of the velocity
-X_L, X_R = -1+U_L/(2*M_REAL)*T**2, U_R/(2*M_REAL)*T**2  # Bounds for the position
-DX = (DT**2)/(2*M_REAL)*DU  # Step between two possible values of the position
-N_X = round(1/DX)  # Resolution of the position
+import dataclasses
+
+
+@dataclasses.dataclass(frozen=True)
+class ProblemConfig:
+    """ Immutable set of parameters of the cart problem, with all the quantities derived from them (steps, bounds and resolutions of the discretizations) computed once.
+    Configs are hashable and can be passed explicitly to the solvers, simulators, environments and index converters,
+    so that independent configurations can be used side by side (e.g. in threads or processes) or as cache keys. """
+    # Physical problem
+    M_REAL: float = 1      # Mass of the cart
+    LAMBDA_P: float = 100  # Penalization for not reaching the target at time T
+    LAMBDA_V: float = 50   # Penalization for not having null velocity at time T
+    T: float = 1           # Time horizon of the problem
+    # Time discretization
+    N: int = 50  # Number of time steps for the simulator
+    # Action discretization
+    U_L: float = -6  # Lower bound for the control
+    U_R: float = 6   # Upper bound for the control
+    N_U: int = 4     # Resolution of the control
+    # Derived quantities, computed from the parameters above
+    DT: float = dataclasses.field(init=False, compare=False)   # Length of a time step
+    DU: float = dataclasses.field(init=False, compare=False)   # Step between two possible values of the control
+    V_L: float = dataclasses.field(init=False, compare=False)  # Lower bound for the velocity
+    V_R: float = dataclasses.field(init=False, compare=False)  # Upper bound for the velocity
+    DV: float = dataclasses.field(init=False, compare=False)   # Step between two possible values of the velocity
+    N_V: int = dataclasses.field(init=False, compare=False)    # Resolution of the velocity
+    X_L: float = dataclasses.field(init=False, compare=False)  # Lower bound for the position
+    X_R: float = dataclasses.field(init=False, compare=False)  # Upper bound for the position
+    DX: float = dataclasses.field(init=False, compare=False)   # Step between two possible values of the position
+    N_X: int = dataclasses.field(init=False, compare=False)    # Resolution of the position
+
+    def __post_init__(self):
+        DT = self.T/self.N
+        DU = 1/self.N_U
+        DV = DU/self.M_REAL*DT
+        DX = (DT**2)/(2*self.M_REAL)*DU
+        derived = {
+            "DT": DT,
+            "DU": DU,
+            "V_L": self.U_L/self.M_REAL*self.T,
+            "V_R": self.U_R/self.M_REAL*self.T,
+            "DV": DV,
+            "N_V": round(1/DV),
+            "X_L": -1+self.U_L/(2*self.M_REAL)*self.T**2,
+            "X_R": self.U_R/(2*self.M_REAL)*self.T**2,
+            "DX": DX,
+            "N_X": round(1/DX)
+        }
+        for name, value in derived.items():
+            object.__setattr__(self, name, value)
+
+    def replace(self, **changes):
+        """ Returns a new config where the given parameters (e.g. N=8) are changed, and the derived quantities are recomputed. """
+        return dataclasses.replace(self, **changes)
+
+
+# The current config is exposed as module globals, which are used by default by all functions of the program.
+# They must only be modified through the update functions below, which keep them consistent with the current config.
+_config = None
+
+
+def set_config(config):
+    """ Sets the current config, updating the global parameters of the program. """
+    global _config, M_REAL, LAMBDA_P, LAMBDA_V, T, N, DT, U_L, U_R, N_U, DU, V_L, V_R, DV, N_V, X_L, X_R, DX, N_X
+    _config = config
+    M_REAL, LAMBDA_P, LAMBDA_V, T = config.M_REAL, config.LAMBDA_P, config.LAMBDA_V, config.T
+    N, DT = config.N, config.DT
+    U_L, U_R, N_U, DU = config.U_L, config.U_R, config.N_U, config.DU
+    V_L, V_R, DV, N_V = config.V_L, config.V_R, config.DV, config.N_V
+    X_L, X_R, DX, N_X = config.X_L, config.X_R, config.DX, config.N_X
+
+
+def get_config(config=None):
+    """ Returns the given config, or the current config (matching the global parameters) if None. """
+    return _config if config is None else config
+
+
+set_config(ProblemConfig())
 
 
 def print_current_parameters(physical_problem=True, time_discretization=False, space_action_discretizations=False):
@@ -56,33 +114,25 @@ def print_current_parameters(physical_problem=True, time_discretization=False, s
             print(f"{item}:", value)
 
 
-def update_action_space_parameters(new_N_U=N_U, new_U_L=U_L, new_U_R=U_R):
-    """ Updates the action (and space) parameters with a new value for U_L, U_R and N_U. """
-    global U_L, U_R, N_U, DU, V_L, V_R, DV, N_V, X_L, X_R, DX, N_X
-    U_L, U_R = new_U_L, new_U_R
-    N_U = new_N_U
-    DU = 1/N_U
-    V_L, V_R = U_L/M_REAL*T, U_R/M_REAL*T
-    DV = DU/M_REAL*DT
-    N_V = round(1/DV)
-    X_L, X_R = -1+U_L/(2*M_REAL)*T**2, U_R/(2*M_REAL)*T**2
-    DX = (DT**2)/(2*M_REAL)*DU
-    N_X = round(1/DX)
+def update_action_space_parameters(new_N_U=None, new_U_L=None, new_U_R=None):
+    """ Updates the action (and space) parameters with a new value for U_L, U_R and N_U. Parameters that are None keep their current value. """
+    set_config(_config.replace(
+        N_U=N_U if new_N_U is None else new_N_U,
+        U_L=U_L if new_U_L is None else new_U_L,
+        U_R=U_R if new_U_R is None else new_U_R
+    ))
 
 
-def update_time_parameters(new_N=N):
+def update_time_parameters(new_N=None):
     """ Updates the time parameters with a new value for N. """
-    global N, DT
-    N = new_N
-    DT = T/N
-    update_action_space_parameters(N_U, U_L, U_R)
+    set_config(_config.replace(N=N if new_N is None else new_N))
 
 
-def update_physical_parameters(new_M_REAL=M_REAL, new_LAMBDA_P=LAMBDA_P, new_LAMBDA_V=LAMBDA_V, new_T=T):
-    """ Updates the time parameters with a new value for N. """
-    global M_REAL, LAMBDA_P, LAMBDA_V, T
-    M_REAL = new_M_REAL
-    LAMBDA_P = new_LAMBDA_P
-    LAMBDA_V = new_LAMBDA_V
-    T = new_T
-    update_time_parameters(new_N=N)
+def update_physical_parameters(new_M_REAL=None, new_LAMBDA_P=None, new_LAMBDA_V=None, new_T=None):
+    """ Updates the physical parameters with new values for M_REAL, LAMBDA_P, LAMBDA_V and T. Parameters that are None keep their current value. """
+    set_config(_config.replace(
+        M_REAL=M_REAL if new_M_REAL is None else new_M_REAL,
+        LAMBDA_P=LAMBDA_P if new_LAMBDA_P is None else new_LAMBDA_P,
+        LAMBDA_V=LAMBDA_V if new_LAMBDA_V is None else new_LAMBDA_V,
+        T=T if new_T is None else new_T
+    ))
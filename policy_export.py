@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import numpy as np
+import params as p
+from problem import batch_simulator, trajectory_cost
+from grid import grid_mapper, bilinear_interpolation
+from dp_storage import BandedArray
+# Loading and querying exported policies does not import torch: the solvers and stable-baselines3 are only imported lazily, to distill policies.
+
+
+class TabularPolicy:
+    """ Policy given by a table of actions on a uniform grid of time steps, positions and velocities, distilled from a DP policy or a trained RL agent.
+    The actions are looked up (nearest grid point) or interpolated bilinearly in (x, v), for batches of states at once with NumPy operations only.
+    States outside of the table are clipped to its boundary. Tables are saved as .npy files, which can be memory-mapped when loading.
+    """
+
+    def __init__(self, actions, x_range, v_range, dt, interpolation="nearest"):
+        """
+        :param np.ndarray[float] actions: Actions at each time step, position and velocity of the grid, of dimension N x x_size x v_size.
+        :param tuple[float] x_range: Lowest and highest positions of the grid.
+        :param tuple[float] v_range: Lowest and highest velocities of the grid.
+        :param float dt: Length of a time step.
+        :param (string, optional) interpolation: Either "nearest" or "bilinear". Defaults to "nearest".
+        """
+        if interpolation not in ("nearest", "bilinear"):
+            raise ValueError(f"Unknown interpolation {interpolation}, expected \"nearest\" or \"bilinear\".")
+        self.actions = actions
+        self.x_range, self.v_range = (float(x_range[0]), float(x_range[1])), (float(v_range[0]), float(v_range[1]))
+        self.dt = float(dt)
+        self.interpolation = interpolation
+        self._x_scale = (actions.shape[1]-1)/(self.x_range[1]-self.x_range[0])
+        self._v_scale = (actions.shape[2]-1)/(self.v_range[1]-self.v_range[0])
+
+    @property
+    def nbytes(self):
+        """ Number of bytes of the table. """
+        return self.actions.nbytes
+
+    def grid(self):
+        """ Returns the positions and velocities of the grid. """
+        return np.linspace(*self.x_range, self.actions.shape[1]), np.linspace(*self.v_range, self.actions.shape[2])
+
+    def act(self, n, x, v):
+        """ Returns the actions for time steps n, positions x and velocities v, given as scalars or arrays broadcast together. """
+        n = np.clip(n, 0, self.actions.shape[0]-1)
+        fx = np.clip((x - self.x_range[0])*self._x_scale, 0, self.actions.shape[1]-1)
+        fv = np.clip((v - self.v_range[0])*self._v_scale, 0, self.actions.shape[2]-1)
+        nearest = self.actions[n, np.rint(fx).astype(np.intp), np.rint(fv).astype(np.intp)]
+        if self.interpolation == "nearest":
+            return nearest[()]
+        actions = bilinear_interpolation(self.actions, n, fx, fv)
+        # Interpolations involving undefined actions (e.g. unreachable states of a DP policy) fall back to the nearest grid point
+        return np.where(np.isfinite(actions), actions, nearest)[()]
+
+    def __call__(self, t, x, v):
+        """ Returns the actions at times t, positions x and velocities v, as a policy usable by problem.simulator and problem.batch_simulator. """
+        return self.act(np.rint(np.asarray(t)/self.dt).astype(np.intp), x, v)
+
+    def save(self, directory, name="policy"):
+        """ Saves the policy in the given directory, as a .npy file for the table of actions and a .json file for the grid. """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, f"{name}.npy"), self.actions)
+        layout = {"x_range": self.x_range, "v_range": self.v_range, "dt": self.dt, "interpolation": self.interpolation}
+        with open(os.path.join(directory, f"{name}_layout.json"), "w") as layout_file:
+            json.dump(layout, layout_file)
+
+    @classmethod
+    def load(cls, directory, name="policy", mmap_mode="r", interpolation=None):
+        """ Loads a policy saved with TabularPolicy.save. By default, the table is memory-mapped (mmap_mode="r") rather than read from disk.
+        The interpolation can be changed from the saved one, e.g. to compare both on the same table. """
+        with open(os.path.join(directory, f"{name}_layout.json"), "r") as layout_file:
+            layout = json.load(layout_file)
+        actions = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+        return cls(actions, layout["x_range"], layout["v_range"], layout["dt"], interpolation=interpolation or layout["interpolation"])
+
+
+# Distillation
+
+def sb3_policy(model, config=None):
+    """ Wraps a stable-baselines3 model trained on the cart problem into a policy usable by problem.simulator and problem.batch_simulator,
+    which queries the model with deterministic actions for a whole batch of states at once. """
+    c = p.get_config(config)
+    def policy(t, x, v):
+        n, x, v = np.broadcast_arrays(np.rint(np.asarray(t)/c.DT).astype(np.int64), x, v)
+        observation = dict(cart_state=np.stack([x.ravel(), v.ravel()], axis=-1).astype(np.float32), timestep=n.ravel())
+        actions, _ = model.predict(observation, deterministic=True)
+        return actions[:, 0].reshape(x.shape)[()]
+    return policy
+
+
+def visited_ranges(policy, config=None, n_trajectories=101, margin=0.1):
+    """ Returns the ranges of positions and velocities visited by a policy from initial positions in [-1, 0], widened by a relative margin on each side. """
+    c = p.get_config(config)
+    x, v, _ = batch_simulator(np.linspace(-1, 0, n_trajectories), policy, return_velocity=True, config=c)
+    ranges = []
+    for values in (x, v):
+        low, high = np.min(values), np.max(values)
+        width = max(high - low, 1e-3)
+        ranges.append((low - margin*width, high + margin*width))
+    return ranges
+
+
+def distill(policy, x_size=201, v_size=201, x_range=None, v_range=None, interpolation="nearest", config=None, batch_size=2**16):
+    """ Distills a policy into a TabularPolicy, by evaluating it at every time step on a grid of x_size positions and v_size velocities.
+
+    :param function policy: Vectorized policy, that given arrays of times, positions and velocities returns an array of actions.
+    :param (int, optional) x_size: Number of positions of the grid. Defaults to 201.
+    :param (int, optional) v_size: Number of velocities of the grid. Defaults to 201.
+    :param (tuple[float], optional) x_range: Lowest and highest positions of the grid. If None, the range visited by the policy (see visited_ranges). Defaults to None.
+    :param (tuple[float], optional) v_range: Lowest and highest velocities of the grid. If None, the range visited by the policy. Defaults to None.
+    :param (string, optional) interpolation: Interpolation of the TabularPolicy, "nearest" or "bilinear". Defaults to "nearest".
+    :param (ProblemConfig, optional) config: Parameters of the problem the policy solves. If None, uses the current config. Defaults to None.
+    :param (int, optional) batch_size: Maximal number of states for which the policy is queried at once. Defaults to 2**16.
+    :rtype: TabularPolicy
+    """
+    c = p.get_config(config)
+    if x_range is None or v_range is None:
+        visited_x_range, visited_v_range = visited_ranges(policy, config=c)
+        x_range, v_range = x_range or visited_x_range, v_range or visited_v_range
+    n, x, v = np.meshgrid(np.arange(c.N), np.linspace(*x_range, x_size), np.linspace(*v_range, v_size), indexing="ij")
+    n, x, v = n.ravel(), x.ravel(), v.ravel()
+    actions = np.empty(n.shape[0], dtype=np.float32)
+    for start in range(0, n.shape[0], batch_size):
+        actions[start:start+batch_size] = policy(n[start:start+batch_size]*c.DT, x[start:start+batch_size], v[start:start+batch_size])
+    return TabularPolicy(actions.reshape(c.N, x_size, v_size), x_range, v_range, c.DT, interpolation=interpolation)
+
+
+def distill_dp(optimal_policy_array, x_size=None, v_size=None, interpolation="nearest", config=None):
+    """ Distills an optimal policy array, as returned by dp_solver.solve_dp, into a TabularPolicy.
+    If x_size and v_size are None, the table keeps the resolution of the DP grid over the range of reachable states.
+    Unreachable states then have infinite actions, as in the DP policy.
+    Otherwise, the DP policy is resampled on a grid of x_size positions and v_size velocities over the range it visits (see distill).
+    Since the points of a coarser grid can fall between reachable states, the unreachable ones take the action of the nearest reachable point. """
+    from dp_solver import policy_from_array
+    grid = grid_mapper(config)
+    policy = policy_from_array(optimal_policy_array, config=grid.config)
+    if x_size is not None or v_size is not None:
+        from scipy.ndimage import distance_transform_edt
+        tabular_policy = distill(policy, x_size=x_size or 201, v_size=v_size or 201, interpolation=interpolation, config=grid.config)
+        for actions in tabular_policy.actions:
+            unreachable = ~np.isfinite(actions)
+            if np.any(unreachable) and not np.all(unreachable):
+                _, (ix, iv) = distance_transform_edt(unreachable, return_indices=True)
+                actions[...] = actions[ix, iv]
+        return tabular_policy
+    if isinstance(optimal_policy_array, BandedArray):
+        stored = np.prod(optimal_policy_array.band_shapes, axis=1) > 0
+        low, high = optimal_policy_array.offsets[stored], optimal_policy_array.offsets[stored] + optimal_policy_array.band_shapes[stored] - 1
+        (ix_low, iv_low), (ix_high, iv_high) = np.min(low, axis=0), np.max(high, axis=0)
+    else:
+        reachable = np.isfinite(optimal_policy_array)
+        ix_reachable, iv_reachable = np.flatnonzero(np.any(reachable, axis=(0, 2))), np.flatnonzero(np.any(reachable, axis=(0, 1)))
+        (ix_low, iv_low), (ix_high, iv_high) = (ix_reachable[0], iv_reachable[0]), (ix_reachable[-1], iv_reachable[-1])
+    x_range, v_range = (grid.x.from_index(ix_low), grid.x.from_index(ix_high)), (grid.v.from_index(iv_low), grid.v.from_index(iv_high))
+    return distill(policy, x_size=ix_high-ix_low+1, v_size=iv_high-iv_low+1, x_range=x_range, v_range=v_range, interpolation=interpolation, config=grid.config)
+
+
+def distill_sb3(model_path, x_size=201, v_size=201, interpolation="nearest", config=None, Algo=None):
+    """ Distills a trained RL agent saved by stable-baselines3 (e.g. "Agents/PPO_3/best_model.zip") into a TabularPolicy, over the range of states it visits.
+    The config must be the one the agent was trained for (the current one if None). Algo is the algorithm of the agent, PPO if None. """
+    if Algo is None:
+        from stable_baselines3 import PPO as Algo
+    model = Algo.load(model_path, device="cpu")
+    return distill(sb3_policy(model, config=config), x_size=x_size, v_size=v_size, interpolation=interpolation, config=config)
+
+
+# Evaluation
+
+def _median_time(function, repeats):
+    """ Median wall time of a call to function, in seconds. """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def accuracy_latency_report(source_policy, tabular_policies, config=None, n_trajectories=1000, batch_sizes=(1, 1000), repeats=100):
+    """ Compares tabular policies with the policy they were distilled from, in terms of accuracy and latency.
+
+    Accuracy is measured on the states visited by the source policy from n_trajectories initial positions evenly spaced in [-1, 0]:
+    maximal and mean absolute differences between the actions of both policies, and mean relative cost regret of the closed-loop trajectories (costs computed by problem.trajectory_cost).
+    Latency is the median wall time of a query for a batch of each of batch_sizes states.
+
+    :param function source_policy: Vectorized policy the tabular policies were distilled from (e.g. sb3_policy(model) or dp_solver.policy_from_array(array)).
+    :param dict tabular_policies: TabularPolicy objects, by name.
+    :return list[dict]: One row per policy (the source policy being named "source"), with the table size in bytes, the accuracy metrics and the latency per batch size, in seconds.
+    """
+    c = p.get_config(config)
+    x_0s = np.linspace(-1, 0, n_trajectories)
+    x, v, u = batch_simulator(x_0s, source_policy, return_velocity=True, config=c)
+    source_costs = trajectory_cost(x, v, u, config=c)
+    t = np.broadcast_to(np.arange(c.N)*c.DT, u.shape).ravel()
+    states = (t, x[:, :-1].ravel(), v[:, :-1].ravel())
+    rows = []
+    for name, policy in dict(source=source_policy, **tabular_policies).items():
+        action_errors = np.abs(policy(*states) - u.ravel())
+        policy_x, policy_v, policy_u = batch_simulator(x_0s, policy, return_velocity=True, config=c)
+        row = {
+            "policy": name,
+            "nbytes": getattr(policy, "nbytes", None),
+            "max_action_error": float(np.max(action_errors)),
+            "mean_action_error": float(np.mean(action_errors)),
+            "cost_regret": float(np.mean(trajectory_cost(policy_x, policy_v, policy_u, config=c))/np.mean(source_costs) - 1)
+        }
+        for batch_size in batch_sizes:
+            batch = tuple(values[:batch_size] for values in states)
+            row[f"latency_{batch_size}"] = _median_time(lambda: policy(*batch), repeats)
+        rows.append(row)
+    return rows
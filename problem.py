@@ -4,39 +4,120 @@ import params as p
 
 # Cost
 
-def cost(x, x_dot, u):
-    """ Approximation of the cost function evaluated in a given trajectory-control pair (x, u), using trapezoidal rule. """
-    return p.LAMBDA_P*x[-1]**2 + p.LAMBDA_V*x_dot[-1]**2 + np.trapz(u**2, dx=p.T/u.shape[0])
+def cost(x, x_dot, u, config=None):
+    """ Approximation of the cost function evaluated in a given trajectory-control pair (x, u), using trapezoidal rule.
+    Batches of trajectories can be evaluated at once, time being the last axis of x, x_dot and u. """
+    c = p.get_config(config)
+    return c.LAMBDA_P*x[..., -1]**2 + c.LAMBDA_V*x_dot[..., -1]**2 + np.trapz(u**2, dx=c.T/u.shape[-1], axis=-1)
 
 
-def J(u, x_0, m, dt=None):
-    """ Cost as a function of piece-wise u (after discretization in time) for initial condition x_0, for a given mass m. """
-    dt = p.DT if dt is None else dt
-    x_N = x_0 + dt**2/m * np.sum(np.arange(p.N, 0, -1)*u)
-    v_N = dt/m * np.sum(u)
-    return p.LAMBDA_P*x_N**2 + p.LAMBDA_V*v_N**2 + dt*np.sum(u**2)
+def J(u, x_0, m, dt=None, config=None):
+    """ Cost as a function of piece-wise u (after discretization in time) for initial condition x_0, for a given mass m.
+    Batches of controls can be evaluated at once, time being the last axis of u, with x_0 broadcast against the other axes. """
+    c = p.get_config(config)
+    dt = c.DT if dt is None else dt
+    x_N = x_0 + dt**2/m * np.sum(np.arange(c.N, 0, -1)*u, axis=-1)
+    v_N = dt/m * np.sum(u, axis=-1)
+    return c.LAMBDA_P*x_N**2 + c.LAMBDA_V*v_N**2 + dt*np.sum(u**2, axis=-1)
 
 
+def  running_cost(x_n, v_n, a_n, config=None):
+    """ Running cost for the dynamic programming formulation. """
+    return p.get_config(config).DT*a_n**2
+
+def  final_cost(x_N, v_N, config=None):
+    """ Final cost for the dynamic programming formulation. """
+    c = p.get_config(config)
+    return c.LAMBDA_P*x_N**2 + c.LAMBDA_V*v_N**2
+
+def trajectory_cost(x, v, u, config=None):
+    """ Exact cost of simulated trajectories (e.g. returned by batch_simulator with return_velocity), as the sum of the running costs and the final cost.
+    Unlike J, it uses the positions and velocities actually reached, so it is consistent with dynamics. Time is the last axis of x, v and u. """
+    return np.sum(running_cost(x[..., :-1], v[..., :-1], u, config=config), axis=-1) + final_cost(x[..., -1], v[..., -1], config=config)
+
 
 # State dynamics of the system
 
-def dynamics(x, v, u):
+def dynamics(x, v, u, config=None):
     """ Takes position and action ((x, v), u) and returns a new state x_new. """
-    return x + p.DT*v + p.DT**2/(2*p.M_REAL)*u, v + p.DT/p.M_REAL*u
+    c = p.get_config(config)
+    return x + c.DT*v + c.DT**2/(2*c.M_REAL)*u, v + c.DT/c.M_REAL*u
 
 
-def simulator(x_0, policy):
+def simulator(x_0, policy, config=None):
     """ Runs a simulation of the system between times 0 and T.
-    
+
     :param float x_0: Initial positioni in [0, 1].
     :param function policy: Function that given a position, velocity and time returns an action.
+    :param (ProblemConfig, optional) config: Parameters of the problem. If None, uses the current config. Defaults to None.
     :return: The couple (x, u) where x is the resulting trajectory and u the control which are 2 np.arrays of size (N+1) and (N) respectively, where N=T/DT.
     """
-    x = np.zeros(p.N+1)
-    u = np.zeros(p.N)
+    c = p.get_config(config)
+    x = np.zeros(c.N+1)
+    u = np.zeros(c.N)
     x[0] = x_0
     v = 0
-    for n in range(p.N):
-        u[n] = policy(n*p.DT, x[n], v)
-        x[n+1], v = dynamics(x[n], v, u[n])
+    for n in range(c.N):
+        u[n] = policy(n*c.DT, x[n], v)
+        x[n+1], v = dynamics(x[n], v, u[n], config=c)
     return x, u
+
+
+def batch_simulator(x_0, policy, return_velocity=False, config=None):
+    """ Runs simulations of the system between times 0 and T for a batch of initial positions, stepping all trajectories at once.
+
+    :param np.ndarray[float] x_0: Initial positions in [-1, 0], of dimension B.
+    :param function policy: Vectorized function that given arrays of times, positions and velocities (of dimension B) returns an array of B actions.
+    :param (bool, optional) return_velocity: Whether to also return the velocities, e.g. to evaluate the cost of the trajectories. Defaults to False.
+    :param (ProblemConfig, optional) config: Parameters of the problem. If None, uses the current config. Defaults to None.
+    :return: The couple (x, u) where x are the resulting trajectories and u the controls, which are np.arrays of dimensions B x (N+1) and B x N respectively.
+    If return_velocity is True, the triplet (x, v, u) is returned instead, where v has dimension B x (N+1).
+    """
+    c = p.get_config(config)
+    x_0 = np.asarray(x_0, dtype=float)
+    x = np.zeros((x_0.shape[0], c.N+1))
+    v = np.zeros((x_0.shape[0], c.N+1))
+    u = np.zeros((x_0.shape[0], c.N))
+    x[:, 0] = x_0
+    for n in range(c.N):
+        u[:, n] = policy(np.full(x_0.shape[0], n*c.DT), x[:, n], v[:, n])
+        x[:, n+1], v[:, n+1] = dynamics(x[:, n], v[:, n], u[:, n], config=c)
+    return (x, v, u) if return_velocity else (x, u)
+
+
+# Reachable states for dynamic programming
+
+def reachable_x(t, config=None):
+    """ Returns the set of positions that are reachable in time t from x_0 varying in [-1, 0].
+    Useful in dynamic programming for computing the value function only on relevant states. """
+    c = p.get_config(config)
+    return np.arange(-1 + c.U_L*(t**2)/(2*c.M_REAL), c.U_R*(t**2)/(2*c.M_REAL) + c.DX/2, c.DX)
+
+def reachable_v(t, config=None):
+    """ Returns the set of velocities that are reachable in time t from a null velocity at time 0.
+    Useful in dynamic programming for computing the value function only on relevant states. """
+    c = p.get_config(config)
+    return np.arange(c.U_L/c.M_REAL*t, c.U_R/c.M_REAL*t + c.DV/2, c.DV)
+
+
+# Parameters
+
+def problem_parameters(config=None):
+    """ Returns the parameters of the cart problem for the given config (or the current one if None), as saved alongside trained models (and used to identify solved problems). """
+    c = p.get_config(config)
+    return {
+        "M_REAL": c.M_REAL,
+        "LAMBDA_P": c.LAMBDA_P,
+        "LAMBDA_V": c.LAMBDA_V,
+        "T": c.T,
+        "N": c.N,
+        "U_L": c.U_L,
+        "U_R": c.U_R,
+        "N_U": c.N_U,
+        "V_L": c.V_L,
+        "V_R": c.V_R,
+        "N_V": c.N_V,
+        "X_L": c.X_L,
+        "X_R": c.X_R,
+        "N_X": c.N_X
+    }
@@ -0,0 +1,169 @@
+import os
+import time
+import uuid
+import argparse
+import itertools
+import resource
+import traceback
+import multiprocessing
+import numpy as np
+import params as p
+import scipy.optimize  # Imported lazily by open_loop, but imported here so that the import is not timed with the first run
+from problem import batch_simulator, trajectory_cost
+from analytical import optimal_cost
+from dp_solver import solve_dp, policy_from_array
+from open_loop import solve_by_bfgs
+from dp_cache import cache_key
+from policy_export import sb3_policy
+# torch and stable-baselines3 are only imported by PPO runs (see _import_dependencies), so that the other runs neither load them nor count their memory
+
+
+SOLVERS = ("dp", "bfgs", "ppo")
+SWEPT_PARAMETERS = ("N", "N_U", "LAMBDA_P", "LAMBDA_V", "M_REAL")
+DEFAULT_PPO_OPTIONS = {
+    "hyperparameters": {"learning_rate": 0.001, "gamma": 0.99},  # n_steps and batch_size default to N and 2*N, as in the notebook
+    "n_envs": 8,
+    "training_steps": 50_000,
+    "eval_freq": 500,
+    "native_vec_env": True,
+    "torch_threads": 1  # Runs are already parallelized by the process pool
+}
+
+
+# Sweep definition
+
+def sweep_configs(base_config=None, **parameter_values):
+    """ Returns the configs of the cartesian product of the given parameter values, e.g. sweep_configs(N=[4, 8], N_U=[1, 2]) returns 4 configs.
+    Parameters that are not swept keep the value they have in base_config (the current config if None). """
+    base_config = p.get_config(base_config)
+    names = list(parameter_values)
+    return [base_config.replace(**dict(zip(names, values))) for values in itertools.product(*parameter_values.values())]
+
+
+# Solvers, each returning the vectorized policy to simulate for a given config and batch of initial positions
+
+def _dp_policy(config, options, x_0s):
+    _, optimal_policy_array = solve_dp(storage="banded", keep_value_function=False, config=config)
+    return policy_from_array(optimal_policy_array, config=config)
+
+
+def _bfgs_policy(config, options, x_0s):
+    u = np.stack([solve_by_bfgs(x_0, config.M_REAL, config=config) for x_0 in x_0s])
+    # Open-loop controls, the n-th control of each trajectory being applied at time step n whatever the state
+    return lambda t, x, v: u[:, round(t[0]/config.DT)]
+
+
+def _ppo_policy(config, options, x_0s):
+    import torch
+    from stable_baselines3 import PPO
+    from dp_rl import instantiate_model, train_model
+    options = dict(DEFAULT_PPO_OPTIONS, **options)
+    torch.set_num_threads(options["torch_threads"])
+    hyperparameters = dict({"n_steps": config.N, "batch_size": 2*config.N}, **options["hyperparameters"])
+    # Each run trains a new agent in its own folder, since instantiate_model would resume the training of an agent left by a previous sweep
+    model_name = os.path.join(options.get("model_folder", "sweep"), f"PPO_{cache_key(config)}_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}")
+    model_path, model, _ = instantiate_model(model_name, PPO, hyperparameters, n_envs=options["n_envs"], native_vec_env=options["native_vec_env"], config=config)
+    train_model(model, model_path, training_steps=options["training_steps"], eval_freq=options["eval_freq"], config=config)
+    # Short trainings might end before the first evaluation, in which case there is no best model yet
+    best_model_name = "best_model" if os.path.exists(os.path.join(model_path, "best_model.zip")) else "latest_model"
+    return sb3_policy(PPO.load(os.path.join(model_path, best_model_name)), config=config)
+
+
+_POLICY_MAKERS = {"dp": _dp_policy, "bfgs": _bfgs_policy, "ppo": _ppo_policy}
+
+
+def _import_dependencies(solver):
+    """ Imports the heavy dependencies of a solver, so that they are loaded before its run is measured. """
+    if solver == "ppo":
+        import torch
+        import stable_baselines3
+        import dp_rl
+
+
+# Runs
+
+def _max_rss():
+    """ Maximal resident set size of the process so far, in bytes. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024  # ru_maxrss is in kilobytes on Linux
+
+
+def run_experiment(config, solver, x_0s, solver_options=None):
+    """ Solves the problem given by config with one of the SOLVERS, then simulates the obtained policy from all the initial positions of x_0s at once.
+    The cost of each trajectory is computed from the simulated states (problem.trajectory_cost), so that all the solvers are scored on the dynamics that are actually run.
+    The wall time covers both solving and simulating, but not importing the dependencies of the solver.
+    The peak memory is the increase of the maximal resident set size of the process during the run, in bytes, measured after imports.
+    It is only specific to this run when every run has its own process (as in run_sweep).
+
+    :return dict: The results of the run, with the mean cost achieved, the mean cost of the analytical solution (analytical.optimal_cost) and the maximal gap between both.
+    """
+    _import_dependencies(solver)
+    initial_rss = _max_rss()
+    start = time.perf_counter()
+    policy = _POLICY_MAKERS[solver](config, solver_options or {}, x_0s)
+    x, v, u = batch_simulator(x_0s, policy, return_velocity=True, config=config)
+    costs = trajectory_cost(x, v, u, config=config)
+    wall_time = time.perf_counter() - start
+    analytical_costs = optimal_cost(x_0s, config=config)
+    return {
+        "cost": np.mean(costs),
+        "analytical_cost": np.mean(analytical_costs),
+        "max_cost_gap": np.max(costs - analytical_costs),
+        "wall_time": wall_time,
+        "peak_memory": _max_rss() - initial_rss
+    }
+
+
+def _run_safely(task):
+    """ Runs the experiment of a task (config, solver, x_0s, solver_options), returning the traceback of its error instead of raising it,
+    so that a failed run does not stop the sweep. Returns the config and solver of the task with the results and the error. """
+    config, solver, x_0s, solver_options = task
+    try:
+        return config, solver, run_experiment(config, solver, x_0s, solver_options), ""
+    except Exception:
+        return config, solver, None, traceback.format_exc()
+
+
+def save_results(results_path, rows):
+    """ Saves the results of a sweep as a .npz file holding one array per column (parameters, solver, metrics and error), with a row per run. """
+    columns = {name: np.array([row[name] for row in rows]) for name in rows[0]}
+    np.savez(results_path, **columns)
+
+
+def run_sweep(configs, solvers=("dp", "bfgs"), max_workers=None, results_path="sweep_results.npz", x_0s=None, solver_options=None):
+    """ Runs every solver on every config, spreading the runs across a process pool.
+    Each run is executed in a fresh process, so that runs do not share memory and their peak memories can be measured.
+    The results file is rewritten as runs complete, so that an interrupted sweep keeps the results obtained so far.
+
+    :param list[ProblemConfig] configs: The problem configs to solve, e.g. built with sweep_configs.
+    :param (iterable[string], optional) solvers: The solvers to run among SOLVERS. Defaults to ("dp", "bfgs").
+    :param (int, optional) max_workers: Number of runs executed at once. If None, uses the number of CPUs. Defaults to None.
+    :param (string, optional) results_path: Path to the results file. Defaults to "sweep_results.npz".
+    :param (np.ndarray[float], optional) x_0s: Initial positions from which each policy is simulated. If None, 11 positions evenly spaced in [-1, 0]. Defaults to None.
+    :param (dict, optional) solver_options: Options of each solver, by solver name, e.g. {"ppo": {"training_steps": 10_000}} (see DEFAULT_PPO_OPTIONS). Defaults to None.
+    :return list[dict]: The rows of the results file.
+    """
+    x_0s = np.linspace(-1, 0, 11) if x_0s is None else np.asarray(x_0s)
+    solver_options = solver_options or {}
+    rows = []
+    tasks = [(config, solver, x_0s, solver_options.get(solver)) for config in configs for solver in solvers]
+    # maxtasksperchild=1 gives each run a fresh process, and spawned processes do not inherit the memory of the parent
+    with multiprocessing.get_context("spawn").Pool(max_workers, maxtasksperchild=1) as pool:
+        for config, solver, results, error in pool.imap_unordered(_run_safely, tasks):
+            results = results or dict.fromkeys(("cost", "analytical_cost", "max_cost_gap", "wall_time", "peak_memory"), np.nan)
+            rows.append(dict({name: getattr(config, name) for name in SWEPT_PARAMETERS}, solver=solver, **results, error=error))
+            save_results(results_path, rows)
+            print(f"{len(rows)}/{len(tasks)} {solver} {dict((name, getattr(config, name)) for name in SWEPT_PARAMETERS)}:", error.splitlines()[-1] if error else f"{results['wall_time']:.2f}s")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solves the cart problem for a grid of parameters with several solvers, in parallel.")
+    for name in SWEPT_PARAMETERS:
+        parser.add_argument(f"--{name}", nargs="+", type=int if name in ("N", "N_U") else float, default=[getattr(p, name)], help=f"Values of {name} to sweep.")
+    parser.add_argument("--solvers", nargs="+", choices=SOLVERS, default=["dp", "bfgs"], help="Solvers to run on each config.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of runs executed at once. Defaults to the number of CPUs.")
+    parser.add_argument("--output", default="sweep_results.npz", help="Path to the results file.")
+    parser.add_argument("--training-steps", type=int, default=DEFAULT_PPO_OPTIONS["training_steps"], help="Training steps of each PPO run.")
+    args = parser.parse_args()
+    configs = sweep_configs(**{name: getattr(args, name) for name in SWEPT_PARAMETERS})
+    run_sweep(configs, solvers=args.solvers, max_workers=args.workers, results_path=args.output, solver_options={"ppo": {"training_steps": args.training_steps}})
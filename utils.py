@@ -3,6 +3,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
 import params as p
+from log_store import evaluation_store
+from grid import GridIndexMapper, bilinear_interpolation, StateGridMapper, grid_mapper, to_arr_x, from_arr_x, to_arr_v, from_arr_v, to_arr_a, from_arr_a  # Defined in grid so that they can be imported without matplotlib
 
 
 # Plotting
@@ -127,15 +129,19 @@ def plot_training_evaluations(log_folder, reference_reward=None, crop_reward=Non
     """ Plots the evaluation scores obtained over training steps.
     An evaluation score is the average reward obtained by the RL agent over a number of runs that was chosen during training.
 
-    :param string log_folder: path to the folder containing the evaluation logs.
+    :param string log_folder: path to the folder of the model, containing the evaluation logs (see log_store.evaluation_store).
     :param (float, optional) reference_reward: A reward used as a reference, typically the optimal reward in the worse case where x_0=-1. Defaults to None.
     :param (np.array(float, float), optional) crop_reward: Interval of reward values that will be shown on the y-axis. If None, it is set automatically to fit extremal values of the data. Defaults to None.
     """
-    log = os.path.join(log_folder, "evaluations.npz")
+    evaluations = evaluation_store(log_folder)
+    if len(evaluations) > 0:
+        # The logs are memory-mapped, so only the evaluations that are plotted are read from disk
+        timesteps, accumulated_rewards = evaluations.read("timesteps"), evaluations.read("results")
+    else:
+        # Logs of models trained before the evaluation stores were used
+        evaluation_data = np.load(os.path.join(log_folder, "evaluations.npz"))
+        timesteps, accumulated_rewards = evaluation_data["timesteps"], evaluation_data["results"]
     plt.figure("Evaluations during training")
-    evaluation_data = np.load(log)
-    timesteps = evaluation_data["timesteps"]
-    accumulated_rewards = evaluation_data["results"]
     plt.plot(timesteps, accumulated_rewards.mean(axis=1), label="mean")
     plt.fill_between(timesteps, accumulated_rewards.mean(axis=1) - accumulated_rewards.std(axis=1), accumulated_rewards.mean(axis=1) + accumulated_rewards.std(axis=1), alpha=0.4, label="std", color="gray")
     plt.fill_between(timesteps, accumulated_rewards.min(axis=1), accumulated_rewards.max(axis=1), alpha=0.2, label="min-max", color="gray")
@@ -165,9 +171,3 @@ def transform_interval(a, b, c, d, x):
     """
     return (d-c)/(b-a)*x + (c*b-d*a)/(b-a)
 
-to_arr_x = lambda x: round(transform_interval(p.X_L, p.X_R, 0, (p.X_R-p.X_L)*p.N_X, x))  # This is to convert a position to an index for value functions and policies
-from_arr_x = lambda x: transform_interval(0, (p.X_R-p.X_L)*p.N_X, p.X_L, p.X_R, x)  # Inverse of the previous
-to_arr_v = lambda v: round(transform_interval(p.V_L, p.V_R, 0, (p.V_R-p.V_L)*p.N_V, v))  # This is to convert a velocity to an index for value functions and policies
-from_arr_v = lambda v: transform_interval(0, (p.V_R-p.V_L)*p.N_V, p.V_L, p.V_R, v)  # Inverse of the previous
-to_arr_a = lambda a: round(transform_interval(p.U_L, p.U_R, 0, (p.U_R-p.U_L)*p.N_U, a))  # This is to convert an action to an index for value functions and policies
-from_arr_a = lambda a: transform_interval(0, (p.U_R-p.U_L)*p.N_U, p.U_L, p.U_R, a)  # Inverse of the previous